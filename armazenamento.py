@@ -0,0 +1,364 @@
+import argparse
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+import urllib3
+from dotenv import load_dotenv
+from minio import Minio
+from minio.error import S3Error
+from urllib3.exceptions import InsecureRequestWarning
+
+from banco import conexao
+from cache_equipe import CacheTTL
+from metricas_envio import medir
+
+# Desabilita os avisos de SSL inseguros
+urllib3.disable_warnings(InsecureRequestWarning)
+
+load_dotenv(".env")
+
+# Configuração do MinIO
+MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
+MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY")
+MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY")
+MINIO_BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME")
+
+# Bucket das imagens de rastreamento de abertura
+BUCKET_RASTREAMENTO = "rastreiaemail"
+
+# Endereço público do servidor_pixel.py; sem ele, o pixel continua sendo hospedado no MinIO
+PIXEL_URL_BASE = (os.getenv("PIXEL_URL_BASE") or "").rstrip("/")
+
+# Conexões HTTP reaproveitadas pelo cliente (uploads paralelos precisam de uma por thread)
+MINIO_POOL_MAX = int(os.getenv("MINIO_POOL_MAX", "16"))
+MINIO_TIMEOUT = float(os.getenv("MINIO_TIMEOUT", "30"))  # Segundos de leitura; a conexão tem 5s
+MINIO_VERIFICACAO_SEGUNDOS = float(os.getenv("MINIO_VERIFICACAO_SEGUNDOS", "300"))
+
+# Anexos (boletos): enviados em paralelo e em partes a partir deste tamanho
+ANEXOS_PARALELO = int(os.getenv("ANEXOS_PARALELO", "8"))
+ANEXOS_TAMANHO_PARTE = int(os.getenv("ANEXOS_TAMANHO_PARTE", str(16 * 1024 * 1024)))
+ANEXOS_PREFIXO = "anexos/"
+
+# Links assinados: reaproveitados até pouco antes de expirarem
+LINKS_VALIDADE = timedelta(days=7)  # Padrão do presigned_get_object
+LINKS_MARGEM_MINIMA = float(os.getenv("LINKS_MARGEM_MINIMA", "300"))  # Segundos; a margem é ao menos 10% da validade
+LINKS_CACHE_TAMANHO = int(os.getenv("LINKS_CACHE_TAMANHO", "10000"))
+
+_cliente = None
+_lock_cliente = threading.Lock()
+_buckets_existentes = set()
+_anexos_existentes = set()
+_caches_links = {}
+_verificacao = None
+_estado = {"conectado": None, "erro": None, "verificado_em": None}
+
+
+# Função para obter o cliente do MinIO, criado uma única vez por processo
+# O Streamlit reexecuta o script a cada interação, mas este módulo só é importado uma vez
+def obter_minio():
+    global _cliente
+    if _cliente is None:
+        with _lock_cliente:
+            if _cliente is None:
+                _cliente = Minio(
+                    MINIO_ENDPOINT.strip(),
+                    access_key=MINIO_ACCESS_KEY,
+                    secret_key=MINIO_SECRET_KEY,
+                    secure=True,  # HTTPS
+                    http_client=urllib3.PoolManager(
+                        cert_reqs='CERT_NONE',  # Ignora a verificação do certificado
+                        maxsize=MINIO_POOL_MAX,
+                        block=True,
+                        timeout=urllib3.Timeout(connect=5, read=MINIO_TIMEOUT),
+                        retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+                    )
+                )
+    return _cliente
+
+# Função para garantir que o bucket existe, consultando o MinIO só na primeira vez por processo
+def garantir_bucket(bucket_name):
+    if bucket_name in _buckets_existentes:
+        return
+    cliente = obter_minio()
+    if not cliente.bucket_exists(bucket_name):
+        cliente.make_bucket(bucket_name)
+    _buckets_existentes.add(bucket_name)
+
+# Verificação periódica da conexão com o MinIO, fora do caminho das páginas
+def iniciar_verificacao_minio():
+    global _verificacao
+    if _verificacao is not None and _verificacao.is_alive():
+        return
+    with _lock_cliente:
+        if _verificacao is None or not _verificacao.is_alive():
+            _verificacao = threading.Thread(target=_verificar_minio, daemon=True)
+            _verificacao.start()
+
+def _verificar_minio():
+    while True:
+        try:
+            buckets = obter_minio().list_buckets()
+            if _estado["conectado"] is not True:
+                print("Conexão bem-sucedida. Buckets disponíveis:")
+                for bucket in buckets:
+                    print(bucket.name)
+            _estado.update(conectado=True, erro=None)
+        except Exception as e:
+            print(f"Erro ao conectar ao MinIO: {e}")
+            _estado.update(conectado=False, erro=str(e))
+        _estado["verificado_em"] = time.time()
+        time.sleep(MINIO_VERIFICACAO_SEGUNDOS)
+
+# Função para consultar o resultado da última verificação da conexão (conectado é None antes da primeira)
+def estado_minio():
+    return dict(_estado)
+
+# Um cache por validade: o link fica guardado pela validade menos uma margem de segurança
+# Assim quem recebe o link ainda tem pelo menos a margem para abri-lo
+def _cache_links(validade):
+    cache = _caches_links.get(validade)
+    if cache is None:
+        with _lock_cliente:
+            cache = _caches_links.get(validade)
+            if cache is None:
+                segundos = validade.total_seconds()
+                margem = max(LINKS_MARGEM_MINIMA, segundos * 0.1)
+                cache = CacheTTL(ttl=max(segundos - margem, 0), tamanho_maximo=LINKS_CACHE_TAMANHO)
+                _caches_links[validade] = cache
+    return cache
+
+# Função para obter o link assinado de um objeto, reaproveitando um link ainda válido
+def link_assinado(bucket_name, nome_objeto, validade=LINKS_VALIDADE):
+    return _cache_links(validade).obter(
+        (bucket_name, nome_objeto),
+        lambda: obter_minio().presigned_get_object(bucket_name, nome_objeto, expires=validade)
+    )
+
+# Função para assinar de uma vez os links de vários objetos (ex.: todos os anexos de uma campanha)
+# Retorna {nome_objeto: link}
+def links_assinados(bucket_name, nomes_objetos, validade=LINKS_VALIDADE):
+    cache = _cache_links(validade)
+    cliente = obter_minio()
+    return {
+        nome: cache.obter(
+            (bucket_name, nome),
+            lambda nome=nome: cliente.presigned_get_object(bucket_name, nome, expires=validade)
+        )
+        for nome in dict.fromkeys(nomes_objetos)
+    }
+
+# Função para consultar acertos/falhas do cache de links, por validade em segundos
+def estatisticas_links():
+    return {int(validade.total_seconds()): cache.estatisticas() for validade, cache in _caches_links.items()}
+
+# Função para hospedar a imagem de rastreamento no MinIO com nome único
+def hospedar_imagem_rastreamento(file_name):
+    try:
+        # Verifica se o bucket existe
+        garantir_bucket(BUCKET_RASTREAMENTO)
+
+        # Cria uma imagem de 1x1 pixel
+        from PIL import Image
+        img = Image.new("RGB", (1, 1), color=(255, 255, 255))
+        img_data = BytesIO()
+        img.save(img_data, format="PNG")
+        img_data.seek(0)
+
+        # Envia a imagem para o MinIO
+        obter_minio().put_object(
+            BUCKET_RASTREAMENTO,
+            file_name,
+            img_data,
+            length=img_data.getbuffer().nbytes,
+            content_type="image/png"
+        )
+
+        # Gera o link público para a imagem
+        link = link_assinado(BUCKET_RASTREAMENTO, file_name)
+        return link
+    except Exception as e:
+        print(f"Erro ao hospedar a imagem de rastreamento: {e}")
+        return None
+
+# Função para obter o link do pixel de rastreamento de um e-mail
+# Com o servidor de pixel configurado o link é só formatado, sem nenhuma chamada de rede no envio
+def gerar_link_rastreamento(id_rastreamento):
+    if PIXEL_URL_BASE:
+        return f"{PIXEL_URL_BASE}/{id_rastreamento}.png"
+    with medir("pixel_upload_segundos"):
+        return hospedar_imagem_rastreamento(f"{id_rastreamento}.png")
+
+_indice_pronto = False
+_lock_indice = threading.Lock()
+
+# Função para criar a tabela com o objeto mais recente de cada bucket (idempotente, uma vez por processo)
+def garantir_indice_objetos():
+    global _indice_pronto
+    if _indice_pronto:
+        return
+    with _lock_indice:
+        if _indice_pronto:
+            return
+        with conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS objetos_recentes_minio (
+                bucket TEXT PRIMARY KEY,
+                nome_objeto TEXT NOT NULL,
+                modificado_em TIMESTAMPTZ NOT NULL
+            )
+            """)
+            conn.commit()
+            cursor.close()
+        _indice_pronto = True
+
+# Função chamada após cada upload para manter o índice do último objeto do bucket
+# Nunca interrompe o upload: em caso de erro o índice pode ser reconstruído depois
+def registrar_ultimo_objeto(bucket_name, nome_objeto, modificado_em=None):
+    try:
+        garantir_indice_objetos()
+        with conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+            INSERT INTO objetos_recentes_minio (bucket, nome_objeto, modificado_em)
+            VALUES (%s, %s, COALESCE(%s, now()))
+            ON CONFLICT (bucket) DO UPDATE
+            SET nome_objeto = EXCLUDED.nome_objeto, modificado_em = EXCLUDED.modificado_em
+            WHERE objetos_recentes_minio.modificado_em <= EXCLUDED.modificado_em
+            """, (bucket_name, nome_objeto, modificado_em))
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        print(f"Erro ao atualizar o índice do último objeto: {e}")
+
+# Rotina de reconstrução: varre o bucket inteiro e grava o objeto mais recente no índice
+def reconstruir_indice_objetos(bucket_name):
+    ultimo = None
+    for obj in obter_minio().list_objects(bucket_name, recursive=True):
+        if ultimo is None or obj.last_modified > ultimo.last_modified:
+            ultimo = obj
+    if ultimo is not None:
+        registrar_ultimo_objeto(bucket_name, ultimo.object_name, ultimo.last_modified)
+    return ultimo.object_name if ultimo is not None else None
+
+# Função para obter o nome do último objeto enviado ao bucket com uma única leitura do índice
+# Se o bucket ainda não está no índice, faz a reconstrução uma vez
+def obter_ultimo_objeto(bucket_name):
+    garantir_indice_objetos()
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT nome_objeto FROM objetos_recentes_minio WHERE bucket = %s", (bucket_name,))
+        resultado = cursor.fetchone()
+        cursor.close()
+    if resultado is not None:
+        return resultado[0]
+    return reconstruir_indice_objetos(bucket_name)
+
+# Função para obter o link do último item adicionado ao bucket
+def obter_link_ultimo_item(bucket_name):
+    try:
+        nome_objeto = obter_ultimo_objeto(bucket_name)
+        if nome_objeto is None:
+            return None
+
+        # Gera o link público para o objeto
+        link = link_assinado(bucket_name, nome_objeto)
+        return link
+    except Exception as e:
+        print(f"Erro ao obter o último item do bucket: {e}")
+        return None
+
+# Função para calcular o SHA-256 e o tamanho de um arquivo lendo em blocos, sem copiá-lo inteiro
+def resumo_arquivo(file_data):
+    file_data.seek(0)
+    resumo = hashlib.sha256()
+    tamanho = 0
+    for bloco in iter(lambda: file_data.read(1024 * 1024), b""):
+        resumo.update(bloco)
+        tamanho += len(bloco)
+    file_data.seek(0)
+    return resumo.hexdigest(), tamanho
+
+def _anexo_existe(bucket_name, nome_objeto):
+    if (bucket_name, nome_objeto) in _anexos_existentes:
+        return True
+    try:
+        obter_minio().stat_object(bucket_name, nome_objeto)
+    except S3Error as e:
+        if e.code in ("NoSuchKey", "NoSuchObject"):
+            return False
+        raise
+    _anexos_existentes.add((bucket_name, nome_objeto))
+    return True
+
+def _enviar_anexo_por_resumo(file_data, resumo, tamanho, content_type, extensao, bucket_name):
+    nome_objeto = f"{ANEXOS_PREFIXO}{resumo}.{extensao}"
+    garantir_bucket(bucket_name)
+    if not _anexo_existe(bucket_name, nome_objeto):
+        file_data.seek(0)
+        # O cliente lê o arquivo direto do objeto recebido, em partes de ANEXOS_TAMANHO_PARTE
+        obter_minio().put_object(
+            bucket_name,
+            nome_objeto,
+            file_data,
+            length=tamanho,
+            content_type=content_type,
+            part_size=ANEXOS_TAMANHO_PARTE
+        )
+        _anexos_existentes.add((bucket_name, nome_objeto))
+        registrar_ultimo_objeto(bucket_name, nome_objeto)
+    return nome_objeto
+
+# Função para guardar um anexo pelo conteúdo: arquivos idênticos viram um único objeto
+# Retorna o link do objeto (novo ou já existente)
+def enviar_anexo(file_data, content_type, extensao="pdf", bucket_name=MINIO_BUCKET_NAME):
+    resumo, tamanho = resumo_arquivo(file_data)
+    nome_objeto = _enviar_anexo_por_resumo(file_data, resumo, tamanho, content_type, extensao, bucket_name)
+    return link_assinado(bucket_name, nome_objeto)
+
+# Função para enviar os anexos de uma mala direta: {chave (ex.: e-mail): arquivo}
+# Cada conteúdo distinto é enviado uma vez, com até ANEXOS_PARALELO uploads simultâneos
+# Retorna {chave: link}; anexos que falharam ficam com None
+def enviar_anexos(arquivos, content_type, extensao="pdf", bucket_name=MINIO_BUCKET_NAME, paralelo=ANEXOS_PARALELO):
+    por_resumo = {}
+    chaves_por_resumo = {}
+    for chave, file_data in arquivos.items():
+        resumo, tamanho = resumo_arquivo(file_data)
+        por_resumo.setdefault(resumo, (file_data, tamanho))
+        chaves_por_resumo.setdefault(resumo, []).append(chave)
+
+    enviados = {}
+    with ThreadPoolExecutor(max_workers=max(1, paralelo)) as executor:
+        futuros = {
+            resumo: executor.submit(
+                _enviar_anexo_por_resumo, file_data, resumo, tamanho, content_type, extensao, bucket_name
+            )
+            for resumo, (file_data, tamanho) in por_resumo.items()
+        }
+        for resumo, futuro in futuros.items():
+            try:
+                enviados[resumo] = futuro.result()
+            except Exception as e:
+                print(f"Erro ao enviar anexo {resumo}: {e}")
+
+    # Assina todos os links da campanha em uma passada
+    links_por_nome = links_assinados(bucket_name, enviados.values())
+    links = {}
+    for resumo, chaves in chaves_por_resumo.items():
+        for chave in chaves:
+            links[chave] = links_por_nome.get(enviados.get(resumo))
+    return links
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manutenção do armazenamento no MinIO")
+    parser.add_argument("comando", choices=["reconstruir-indice"])
+    parser.add_argument("--bucket", action="append", help="Pode ser repetido; padrão: MINIO_BUCKET_NAME")
+    args = parser.parse_args()
+
+    for bucket in args.bucket or [MINIO_BUCKET_NAME]:
+        print(f"{bucket}: último objeto {reconstruir_indice_objetos(bucket)}")
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool
+from dotenv import load_dotenv
+
+load_dotenv(".env")
+
+# Configuração do banco de dados PostgreSQL
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+
+# Configuração do pool de conexões (compartilhado por todas as sessões do processo)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Segundos aguardando uma conexão livre
+DB_POOL_PING = float(os.getenv("DB_POOL_PING", "60"))  # Conexões ociosas há mais tempo que isso são testadas
+
+# Quantidade de linhas enviadas por comando nas inserções em lote
+DB_BULK_CHUNK = int(os.getenv("DB_BULK_CHUNK", "1000"))
+
+_pool = None
+_vagas = None
+_lock = threading.Lock()
+_ultimo_uso = {}
+
+# Contadores usados para dimensionar o pool sob carga
+_estatisticas = {
+    "checkouts": 0,
+    "esperas": 0,
+    "tempo_espera": 0.0,
+    "em_uso": 0,
+    "descartadas": 0,
+}
+
+# Função para obter (ou criar) o pool de conexões do processo
+def obter_pool():
+    global _pool, _vagas
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = pool.ThreadedConnectionPool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    database=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD
+                )
+                # O ThreadedConnectionPool falha quando esgotado; o semáforo faz as sessões aguardarem
+                _vagas = threading.BoundedSemaphore(DB_POOL_MAX)
+    return _pool
+
+# Função para verificar se uma conexão emprestada do pool ainda está utilizável
+def _conexao_saudavel(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - _ultimo_uso.get(id(conn), 0) < DB_POOL_PING:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+# Função para pegar uma conexão do pool, aguardando se todas estiverem em uso
+def _pegar_conexao():
+    pool_conexoes = obter_pool()
+    if not _vagas.acquire(blocking=False):
+        inicio = time.monotonic()
+        with _lock:
+            _estatisticas["esperas"] += 1
+        if not _vagas.acquire(timeout=DB_POOL_TIMEOUT):
+            raise pool.PoolError("Tempo esgotado aguardando uma conexão livre no pool")
+        with _lock:
+            _estatisticas["tempo_espera"] += time.monotonic() - inicio
+
+    try:
+        conn = pool_conexoes.getconn()
+        # Descarta conexões quebradas (queda de rede, restart do servidor) e tenta outra
+        while not _conexao_saudavel(conn):
+            pool_conexoes.putconn(conn, close=True)
+            _ultimo_uso.pop(id(conn), None)
+            with _lock:
+                _estatisticas["descartadas"] += 1
+            conn = pool_conexoes.getconn()
+    except Exception:
+        _vagas.release()
+        raise
+
+    with _lock:
+        _estatisticas["checkouts"] += 1
+        _estatisticas["em_uso"] += 1
+    return conn
+
+# Função para devolver uma conexão ao pool
+def _devolver_conexao(conn):
+    try:
+        quebrada = conn.closed != 0
+        if not quebrada and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Nunca devolve uma transação aberta ao pool
+            conn.rollback()
+        if quebrada:
+            _ultimo_uso.pop(id(conn), None)
+        else:
+            _ultimo_uso[id(conn)] = time.monotonic()
+        obter_pool().putconn(conn, close=quebrada)
+    except psycopg2.Error:
+        _ultimo_uso.pop(id(conn), None)
+        obter_pool().putconn(conn, close=True)
+    finally:
+        with _lock:
+            _estatisticas["em_uso"] -= 1
+        _vagas.release()
+
+# Gerenciador de contexto que empresta uma conexão e garante a devolução, inclusive em erros
+@contextmanager
+def conexao():
+    conn = _pegar_conexao()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        _devolver_conexao(conn)
+
+# Gerenciador de contexto para comandos que não podem rodar numa transação (ex.: CREATE INDEX CONCURRENTLY)
+@contextmanager
+def conexao_autocommit():
+    with conexao() as conn:
+        conn.autocommit = True
+        try:
+            yield conn
+        finally:
+            if not conn.closed:
+                conn.autocommit = False
+
+# Função para obter um retrato dos contadores do pool
+def estatisticas_pool():
+    with _lock:
+        dados = dict(_estatisticas)
+    dados["tamanho_maximo"] = DB_POOL_MAX
+    return dados
@@ -0,0 +1,141 @@
+import functools
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+import banco
+
+# Configuração do cache das consultas à tabela Equipe_Completa
+CACHE_EQUIPE_TTL = float(os.getenv("CACHE_EQUIPE_TTL", "300"))  # Segundos
+CACHE_EQUIPE_TAMANHO = int(os.getenv("CACHE_EQUIPE_TAMANHO", "1024"))  # Entradas por função
+
+# Canal do PostgreSQL usado para avisar outros processos (ex.: getaoequipe.py) que a equipe mudou
+CANAL_INVALIDACAO = "equipe_alterada"
+
+_caches = {}
+_escuta = None
+_lock_escuta = threading.Lock()
+
+
+# Cache em memória com expiração por tempo e descarte do item menos usado quando cheio
+class CacheTTL:
+    def __init__(self, ttl=CACHE_EQUIPE_TTL, tamanho_maximo=CACHE_EQUIPE_TAMANHO):
+        self.ttl = ttl
+        self.tamanho_maximo = tamanho_maximo
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.descartes = 0
+        self._geracao = 0
+
+    def obter(self, chave, carregar):
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[0] > agora:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return item[1]
+            self.falhas += 1
+            geracao = self._geracao
+
+        # Carrega fora do lock; exceções não são guardadas no cache
+        valor = carregar()
+        with self._lock:
+            if geracao != self._geracao:
+                return valor  # Invalidado durante a consulta: o valor pode estar desatualizado
+            self._itens[chave] = (agora + self.ttl, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho_maximo:
+                self._itens.popitem(last=False)
+                self.descartes += 1
+        return valor
+
+    def invalidar(self):
+        with self._lock:
+            self._itens.clear()
+            self._geracao += 1
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "descartes": self.descartes,
+                "itens": len(self._itens),
+                "taxa_acerto": self.acertos / total if total else 0.0,
+            }
+
+
+# Decorador que guarda em cache o resultado de uma consulta à equipe, pela tupla de argumentos
+def cache_equipe(func=None, ttl=CACHE_EQUIPE_TTL, tamanho_maximo=CACHE_EQUIPE_TAMANHO):
+    if func is None:
+        return functools.partial(cache_equipe, ttl=ttl, tamanho_maximo=tamanho_maximo)
+
+    cache = CacheTTL(ttl, tamanho_maximo)
+    _caches[func.__name__] = cache
+
+    @functools.wraps(func)
+    def consultar(*args):
+        _iniciar_escuta()
+        return cache.obter(args, lambda: func(*args))
+
+    consultar.cache = cache
+    return consultar
+
+# Função chamada após alterações na equipe: limpa o cache local e, com um cursor, avisa os outros processos
+# O NOTIFY só é entregue quando a transação do cursor for confirmada
+def invalidar_equipe(cursor=None):
+    for cache in _caches.values():
+        cache.invalidar()
+    if cursor is not None:
+        cursor.execute("SELECT pg_notify(%s, '')", (CANAL_INVALIDACAO,))
+
+# Função para obter os contadores de acerto/falha de cada consulta em cache
+def estatisticas_cache():
+    return {nome: cache.estatisticas() for nome, cache in _caches.items()}
+
+# Thread que escuta as invalidações enviadas por outros processos
+def _iniciar_escuta():
+    global _escuta
+    if _escuta is not None and _escuta.is_alive():
+        return
+    with _lock_escuta:
+        if _escuta is None or not _escuta.is_alive():
+            _escuta = threading.Thread(target=_escutar_invalidacoes, daemon=True)
+            _escuta.start()
+
+def _escutar_invalidacoes():
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(
+                host=banco.DB_HOST,
+                port=banco.DB_PORT,
+                database=banco.DB_NAME,
+                user=banco.DB_USER,
+                password=banco.DB_PASSWORD
+            )
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {CANAL_INVALIDACAO}")
+            # Alterações feitas enquanto a escuta estava desconectada não foram recebidas
+            invalidar_equipe()
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    invalidar_equipe()
+        except Exception as e:
+            print(f"Erro na escuta de invalidação do cache da equipe: {e}")
+            if conn is not None:
+                conn.close()
+            time.sleep(30)
@@ -0,0 +1,155 @@
+import argparse
+import hashlib
+import re
+import time
+from functools import lru_cache
+
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+from banco import conexao
+from migracoes import verificar_esquema
+from modelo_email import CAMPO_RASTREAMENTO, compilar_modelo
+
+# Linhas migradas por transação no backfill
+BACKFILL_TAMANHO_LOTE = 500
+
+# Marcador de rastreamento gerado pelo HTML do painel (usado para reconstruir o modelo das linhas antigas)
+_REGEX_PIXEL = re.compile(r'(<img src=")[^"]*(" alt="" style="display:none;width:1px;height:1px;">)')
+
+def _hash_modelo(modelo):
+    return hashlib.sha256(modelo.encode("utf-8")).hexdigest()
+
+# Função para gravar uma campanha (ou reaproveitar uma idêntica) usando o cursor da transação em andamento
+def criar_campanha(cursor, remetente, assunto, modelo):
+    cursor.execute("""
+    INSERT INTO campanhas_email (remetente, assunto, modelo, hash_modelo)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (remetente, assunto, hash_modelo) DO UPDATE SET remetente = EXCLUDED.remetente
+    RETURNING id
+    """, (remetente, assunto, modelo, _hash_modelo(modelo)))
+    return cursor.fetchone()[0]
+
+# Função para obter o modelo de uma campanha (o modelo não muda depois de gravado, então fica em cache)
+@lru_cache(maxsize=256)
+def obter_modelo_campanha(campanha_id):
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT modelo FROM campanhas_email WHERE id = %s", (campanha_id,))
+        resultado = cursor.fetchone()
+        cursor.close()
+    if resultado is None:
+        raise ValueError(f"Campanha {campanha_id} não encontrada")
+    return resultado[0]
+
+# Função para montar o corpo de uma linha de rastreamento_emails no momento do envio ou da prévia
+# A linha precisa de campanha_id, valores e nome_destinatario (e corpo, para linhas não migradas)
+def renderizar_corpo(linha, extras=None, parcial=False):
+    valores = dict(linha.get("valores") or {})
+    valores.setdefault("Nome-RU", linha.get("nome_destinatario"))
+    valores.update(extras or {})
+    if linha.get("campanha_id") is not None:
+        modelo = obter_modelo_campanha(linha["campanha_id"])
+    else:
+        modelo = linha["corpo"]
+    return compilar_modelo(modelo).renderizar(valores, parcial=parcial)
+
+# Função para obter a prévia do modelo de uma campanha, com os campos ainda não preenchidos
+def obter_previa_campanha(campanha_id):
+    return compilar_modelo(obter_modelo_campanha(campanha_id)).renderizar({CAMPO_RASTREAMENTO: ""}, parcial=True)
+
+# Função para obter a prévia de uma linha ainda não migrada para campanha (corpo gravado na própria linha)
+@lru_cache(maxsize=64)
+def obter_previa_email(id_email):
+    with conexao() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(
+            "SELECT corpo, campanha_id, valores, nome_destinatario FROM rastreamento_emails WHERE id = %s",
+            (id_email,)
+        )
+        linha = cursor.fetchone()
+        cursor.close()
+    if linha is None:
+        raise ValueError(f"E-mail {id_email} não encontrado")
+    return renderizar_corpo(linha, {CAMPO_RASTREAMENTO: ""}, parcial=True)
+
+# Função para reconstruir o modelo de uma linha antiga, desfazendo a personalização
+# Retorna None se o modelo reconstruído, preenchido com os valores da linha, não reproduz o corpo gravado
+# (ex.: o nome também aparece em outro ponto do HTML ou o corpo tem marcadores de campo literais)
+def _modelo_da_linha(corpo, nome_destinatario):
+    modelo = _REGEX_PIXEL.sub(r"\1{{ " + CAMPO_RASTREAMENTO + r" }}\2", corpo)
+    if nome_destinatario:
+        modelo = modelo.replace(nome_destinatario, "{{ Nome-RU }}")
+    try:
+        renderizado = compilar_modelo(modelo).renderizar({"Nome-RU": nome_destinatario, CAMPO_RASTREAMENTO: ""})
+    except ValueError:
+        return None
+    # O link do pixel é gerado de novo no envio: só ele pode diferir do corpo original
+    if renderizado != _REGEX_PIXEL.sub(r"\1\2", corpo):
+        return None
+    return modelo
+
+# Backfill em lotes: move o corpo das linhas antigas para campanhas, guardando só os valores do destinatário
+# Cada lote é uma transação; interrompido, recomeça de onde parou (linhas já migradas não têm corpo)
+# Linhas cujo modelo não pode ser reconstruído com segurança mantêm o corpo e continuam valendo como estão
+# Retorna (migradas, mantidas)
+def migrar_corpos_legados(tamanho_lote=BACKFILL_TAMANHO_LOTE):
+    verificar_esquema()
+    total = 0
+    mantidas = 0
+    ultimo_id = 0
+    inicio = time.perf_counter()
+    while True:
+        with conexao() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+            SELECT id, remetente, assunto, corpo, nome_destinatario
+            FROM rastreamento_emails
+            WHERE campanha_id IS NULL AND corpo IS NOT NULL AND id > %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """, (ultimo_id, tamanho_lote))
+            linhas = cursor.fetchall()
+            if not linhas:
+                cursor.close()
+                break
+
+            campanhas = {}
+            atualizacoes = []
+            for linha in linhas:
+                modelo = _modelo_da_linha(linha["corpo"], linha["nome_destinatario"])
+                if modelo is None:
+                    mantidas += 1
+                    continue
+                chave = (linha["remetente"], linha["assunto"], modelo)
+                if chave not in campanhas:
+                    campanhas[chave] = criar_campanha(cursor, *chave)
+                atualizacoes.append((linha["id"], campanhas[chave], Json({"Nome-RU": linha["nome_destinatario"]})))
+
+            if atualizacoes:
+                execute_values(cursor, """
+                UPDATE rastreamento_emails r
+                SET campanha_id = v.campanha_id, valores = v.valores, corpo = NULL
+                FROM (VALUES %s) AS v (id, campanha_id, valores)
+                WHERE r.id = v.id
+                """, atualizacoes, template="(%s, %s, %s::jsonb)")
+            conn.commit()
+            cursor.close()
+
+        total += len(atualizacoes)
+        ultimo_id = linhas[-1]["id"]
+        print(
+            f"{total} linhas migradas, {mantidas} mantidas sem migrar "
+            f"({(total + mantidas) / (time.perf_counter() - inicio):.0f} linhas/s)"
+        )
+    return total, mantidas
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manutenção das campanhas de e-mail")
+    parser.add_argument("comando", choices=["backfill"])
+    parser.add_argument("--tamanho-lote", type=int, default=BACKFILL_TAMANHO_LOTE)
+    args = parser.parse_args()
+
+    migradas, mantidas = migrar_corpos_legados(args.tamanho_lote)
+    if mantidas:
+        print(f"{mantidas} linhas mantiveram o corpo original: o modelo reconstruído não reproduzia o e-mail enviado")
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import threading
+import time
+
+from metricas_envio import registrar_resultado_envio
+from smtp_sessoes import SessaoSMTP, SMTP_SERVER, SMTP_PORT
+
+# Limites do provedor por conta remetente (Office 365: 30 mensagens/minuto por caixa)
+SMTP_CONCORRENCIA = int(os.getenv("SMTP_CONCORRENCIA", "3"))  # Conexões simultâneas por conta
+SMTP_LIMITE_MINUTO = int(os.getenv("SMTP_LIMITE_MINUTO", "30"))
+SMTP_LIMITE_DIA = int(os.getenv("SMTP_LIMITE_DIA", "10000"))
+
+
+# Espaçamento local dos envios de uma conta, usado quando nenhum limitador compartilhado é informado
+class LimiteLocal:
+    def __init__(self, por_minuto=SMTP_LIMITE_MINUTO):
+        self.intervalo = 60.0 / por_minuto if por_minuto else 0.0
+        self._proximo = {}
+        self._lock = threading.Lock()
+
+    # Consome um envio e retorna 0, ou retorna quantos segundos faltam para o próximo (nunca bloqueia)
+    def acquire(self, conta):
+        with self._lock:
+            agora = time.monotonic()
+            proximo = self._proximo.get(conta, agora)
+            if proximo > agora:
+                return proximo - agora
+            self._proximo[conta] = agora + self.intervalo
+            return 0.0
+
+
+# Despacha mensagens de uma conta por K conexões SMTP simultâneas, respeitando o limite por minuto
+class DespachanteSMTP:
+    def __init__(self, usuario, senha, concorrencia=SMTP_CONCORRENCIA, limitador=None,
+                 servidor=SMTP_SERVER, porta=SMTP_PORT):
+        self.usuario = usuario
+        self.senha = senha
+        self.concorrencia = max(1, concorrencia)
+        self.limitador = limitador or LimiteLocal()
+        self.servidor = servidor
+        self.porta = porta
+        self.enviados = 0
+        self.falhas = 0
+        self.duracao = 0.0
+
+    @property
+    def mensagens_por_segundo(self):
+        return self.enviados / self.duracao if self.duracao > 0 else 0.0
+
+    async def _aguardar_vaga(self):
+        # O limitador pode ser compartilhado entre processos: tenta de novo após cada espera
+        while True:
+            espera = await asyncio.to_thread(self.limitador.acquire, self.usuario)
+            if espera <= 0:
+                return
+            await asyncio.sleep(espera)
+
+    async def _trabalhador(self, fila, falhas, ao_concluir):
+        # Cada trabalhador mantém sua própria conexão autenticada durante todo o lote
+        sessao = SessaoSMTP(self.usuario, self.senha, self.servidor, self.porta)
+        try:
+            while True:
+                item = await fila.get()
+                if item is None:
+                    break
+                indice, msg = item
+                try:
+                    # Erros do limitador (ex.: banco travado) contam como falha da mensagem, não derrubam o trabalhador
+                    await self._aguardar_vaga()
+                    await asyncio.to_thread(sessao.enviar_mensagem, msg)
+                    erro = None
+                    self.enviados += 1
+                except Exception as e:
+                    erro = e
+                    self.falhas += 1
+                    # Só as falhas são guardadas: a memória não cresce com o tamanho do lote
+                    falhas[indice] = (msg["To"], erro)
+                registrar_resultado_envio(erro)
+                if ao_concluir:
+                    ao_concluir(msg["To"], erro)
+        finally:
+            await asyncio.to_thread(sessao.fechar)
+
+    async def _colocar(self, fila, item, trabalhadores):
+        # Se todos os trabalhadores terminarem com erro, a fila cheia nunca esvaziaria: encerra em vez de travar
+        colocar = asyncio.ensure_future(fila.put(item))
+        while not colocar.done():
+            ativos = [trabalhador for trabalhador in trabalhadores if not trabalhador.done()]
+            if not ativos:
+                colocar.cancel()
+                await asyncio.gather(*trabalhadores)  # Propaga o erro do trabalhador
+                raise RuntimeError("Todas as conexões SMTP do lote foram encerradas")
+            await asyncio.wait([colocar, *ativos], return_when=asyncio.FIRST_COMPLETED)
+
+    async def despachar_async(self, mensagens, ao_concluir=None):
+        inicio = time.perf_counter()
+        fila = asyncio.Queue(maxsize=self.concorrencia * 2)
+        falhas = {}
+        trabalhadores = [
+            asyncio.create_task(self._trabalhador(fila, falhas, ao_concluir))
+            for _ in range(self.concorrencia)
+        ]
+        # As mensagens são consumidas aos poucos: a fila limitada evita materializar o lote inteiro
+        try:
+            for indice, msg in enumerate(mensagens):
+                await self._colocar(fila, (indice, msg), trabalhadores)
+            for _ in trabalhadores:
+                await self._colocar(fila, None, trabalhadores)
+            await asyncio.gather(*trabalhadores)
+        except BaseException:
+            for trabalhador in trabalhadores:
+                trabalhador.cancel()
+            await asyncio.gather(*trabalhadores, return_exceptions=True)
+            raise
+        self.duracao += time.perf_counter() - inicio
+        return [falhas[indice] for indice in sorted(falhas)]
+
+    # Envia as mensagens (objetos MIME com From/To preenchidos); retorna as falhas [(destinatário, erro)]
+    def despachar(self, mensagens, ao_concluir=None):
+        return asyncio.run(self.despachar_async(mensagens, ao_concluir))
@@ -0,0 +1,66 @@
+from openpyxl import load_workbook
+import csv
+import io
+import os
+
+# Leitura das planilhas de destinatários (CSV ou XLSX), usada pela ferramenta de envio e pelo envio_lote.py
+RECIPIENT_CHUNK_SIZE = 1000
+
+
+def iter_recipients(file, chunk_size=RECIPIENT_CHUNK_SIZE):
+    # Lê a planilha linha a linha e entrega os destinatários em blocos, sem carregar o arquivo inteiro
+    name = getattr(file, 'name', file)
+    if str(name).lower().endswith('.csv'):
+        rows = _iter_csv_rows(file)
+    else:
+        rows = _iter_xlsx_rows(file)
+
+    chunk = []
+    for row in rows:
+        email = str(row.get('Email') or '').strip()
+        if not email:
+            continue
+        row['Email'] = email
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_csv_rows(file):
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, newline='', encoding='utf-8-sig') as handle:
+            yield from csv.DictReader(handle, dialect=_sniff_dialect(handle))
+    else:
+        file.seek(0)
+        handle = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        try:
+            yield from csv.DictReader(handle, dialect=_sniff_dialect(handle))
+        finally:
+            handle.detach()
+
+
+def _sniff_dialect(handle):
+    # Planilhas exportadas em pt-BR costumam usar ';' como separador
+    sample = handle.read(4096)
+    handle.seek(0)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        return csv.excel
+
+
+def _iter_xlsx_rows(file):
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(column).strip() if column is not None else '' for column in header]
+        for values in rows:
+            yield {column: value for column, value in zip(columns, values) if column}
+    finally:
+        workbook.close()
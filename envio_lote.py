@@ -0,0 +1,316 @@
+import argparse
+import getpass
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import sys
+import time
+import uuid
+from itertools import islice
+
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+from banco import conexao, DB_BULK_CHUNK
+from campanhas import criar_campanha
+from destinatarios import iter_recipients
+from metricas_envio import iniciar_servidor_metricas
+from migracoes import verificar_esquema
+from fila_envio import (
+    FILA_TAMANHO_LOTE, SMTP_PASSWORD, SMTP_USER, STATUS_NA_FILA,
+    iniciar_publicacao_metricas, processar_lote, publicar_metricas, recuperar_travados,
+    recuperar_travados_periodicamente, reivindicar_lote, verificar_credenciais_smtp
+)
+from modelo_email import CAMPO_RASTREAMENTO, compilar_modelo
+from smtp_sessoes import obter_sessao_smtp
+from despacho_smtp import SMTP_LIMITE_DIA, SMTP_LIMITE_MINUTO
+from limitador_taxa import PostgresBucketStore, RateLimiter
+
+# Códigos de saída para cron/systemd
+SAIDA_OK = 0
+SAIDA_FALHAS = 1  # Alguns e-mails esgotaram as tentativas e ficaram com status Falha
+SAIDA_ENTRADA_INVALIDA = 2  # Arquivo, modelo ou argumentos inválidos
+SAIDA_ERRO = 3  # Erro de banco, SMTP ou de um worker
+
+ENVIO_VERIFICAR_WORKERS = 2  # Segundos sem eventos antes de conferir se os workers continuam vivos
+
+
+# Saída do progresso: uma linha JSON por evento ou texto legível
+class Relator:
+    def __init__(self, em_json):
+        self.em_json = em_json
+
+    def emitir(self, evento, **dados):
+        if self.em_json:
+            print(json.dumps({"evento": evento, "hora": time.time(), **dados}, ensure_ascii=False, default=str), flush=True)
+        elif evento == "progresso":
+            print(
+                f"{dados['enviados']} enviados, {dados['falhas']} falhas "
+                f"({dados['emails_por_segundo']:.1f} e-mails/s)", flush=True
+            )
+        elif evento == "erro":
+            print(f"Erro: {dados['erro']}", file=sys.stderr, flush=True)
+        else:
+            print(f"{evento}: " + ", ".join(f"{chave}={valor}" for chave, valor in dados.items()), flush=True)
+
+
+# Função para ler os destinatários de um arquivo CSV ou XLSX (sem criar o EmailSender nem seu limitador)
+def ler_destinatarios(caminho, limite=None):
+    linhas = (linha for bloco in iter_recipients(caminho) for linha in bloco)
+    return islice(linhas, limite) if limite else linhas
+
+# Função para gravar os destinatários do arquivo já aprovados, prontos para os workers
+# Retorna (campanha_id, quantidade)
+def enfileirar_arquivo(remetente, assunto, modelo, destinatarios, aprovado_por, tamanho_lote=DB_BULK_CHUNK):
+    query = """
+    INSERT INTO rastreamento_emails (remetente, destinatario, nome_destinatario, assunto, campanha_id, valores,
+                                     id_rastreamento, status, aprovado_por)
+    VALUES %s
+    """
+    total = 0
+    with conexao() as conn:
+        cursor = conn.cursor()
+        campanha_id = criar_campanha(cursor, remetente, assunto, modelo.texto)
+        while True:
+            bloco = list(islice(destinatarios, tamanho_lote))
+            if not bloco:
+                break
+            linhas = [
+                (
+                    remetente,
+                    destinatario["Email"],
+                    destinatario.get("Nome-RU"),
+                    assunto,
+                    campanha_id,
+                    Json({campo: destinatario.get(campo) for campo in modelo.campos if campo in destinatario}),
+                    str(uuid.uuid4()),
+                    STATUS_NA_FILA,
+                    aprovado_por,
+                )
+                for destinatario in bloco
+            ]
+            execute_values(cursor, query, linhas, page_size=tamanho_lote)
+            total += len(linhas)
+        # Um único commit: o arquivo é enfileirado inteiro ou não é enfileirado
+        conn.commit()
+        cursor.close()
+    return campanha_id, total
+
+# Função para resumir o que está na fila sem reivindicar nada (usada no --dry-run)
+def resumo_fila(campanha_id=None):
+    filtro_campanha = "AND campanha_id = %s" if campanha_id is not None else ""
+    query = f"""
+    SELECT remetente, campanha_id, assunto, COUNT(*) AS emails
+    FROM rastreamento_emails
+    WHERE status = %s {filtro_campanha}
+    GROUP BY remetente, campanha_id, assunto
+    ORDER BY remetente, campanha_id
+    """
+    with conexao() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(query, [STATUS_NA_FILA] + ([campanha_id] if campanha_id is not None else []))
+        grupos = cursor.fetchall()
+        cursor.close()
+    return grupos
+
+def _reservar(restantes, tamanho):
+    # restantes < 0 significa sem limite
+    with restantes.get_lock():
+        if restantes.value < 0:
+            return tamanho
+        reservado = min(tamanho, restantes.value)
+        restantes.value -= reservado
+        return reservado
+
+def _devolver(restantes, quantidade):
+    with restantes.get_lock():
+        if restantes.value >= 0:
+            restantes.value += quantidade
+
+# Processo worker: envia lotes da fila até esvaziá-la ou atingir o limite, avisando o processo principal
+def _executar_worker_lote(indice, campanha_id, restantes, eventos):
+    # Mensagens de diagnóstico dos workers vão para stderr; stdout fica só com o progresso
+    sys.stdout = sys.stderr
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-cli{indice}"
+    iniciar_servidor_metricas("lote", indice)
+    iniciar_publicacao_metricas(worker_id, "lote")
+    try:
+        sessao = obter_sessao_smtp(SMTP_USER, SMTP_PASSWORD)
+        limitador = RateLimiter(
+            max_emails_per_day=SMTP_LIMITE_DIA,
+            max_emails_per_minute=SMTP_LIMITE_MINUTO,
+            store=PostgresBucketStore(conexao)
+        )
+        # O processo principal já recuperou os travados na partida
+        ultima_recuperacao = time.monotonic()
+        while True:
+            # Em execuções longas, devolve à fila o que outros workers deixaram travado
+            ultima_recuperacao = recuperar_travados_periodicamente(worker_id, ultima_recuperacao)
+            tamanho = _reservar(restantes, FILA_TAMANHO_LOTE)
+            if tamanho == 0:
+                break
+            lote = reivindicar_lote(worker_id, tamanho, campanha_id=campanha_id)
+            if len(lote) < tamanho:
+                _devolver(restantes, tamanho - len(lote))
+            if not lote:
+                break
+            relatorio = processar_lote(sessao, lote, limitador)
+            eventos.put({
+                "evento": "lote",
+                "worker": worker_id,
+                "enviados": sum(grupo["enviados"] for grupo in relatorio),
+                "falhas": sum(grupo["falhas"] for grupo in relatorio),
+            })
+    except Exception as e:
+        eventos.put({"evento": "erro", "worker": worker_id, "erro": str(e)})
+    finally:
+        # Última publicação: o processo termina antes do próximo ciclo da publicação periódica
+        try:
+            publicar_metricas(worker_id, "lote")
+        except Exception as e:
+            print(f"[{worker_id}] Erro ao publicar as métricas: {e}")
+        eventos.put({"evento": "fim", "worker": worker_id, "indice": indice})
+
+# Função para aguardar o próximo evento dos workers
+# Um processo que morreu sem avisar (ex.: morto pelo sistema) vira um evento de erro, em vez de travar a espera
+def _proximo_evento(eventos, processos, ativos):
+    while True:
+        try:
+            return eventos.get(timeout=ENVIO_VERIFICAR_WORKERS)
+        except queue.Empty:
+            pass
+        mortos = [indice for indice in ativos if not processos[indice].is_alive()]
+        if not mortos:
+            continue
+        # O que um processo encerrado enviou já está na fila: só é erro se nada mais chegar
+        try:
+            return eventos.get(timeout=ENVIO_VERIFICAR_WORKERS)
+        except queue.Empty:
+            indice = mortos[0]
+            return {
+                "evento": "morto",
+                "indice": indice,
+                "worker": f"cli{indice}",
+                "erro": f"Processo encerrado sem concluir (código de saída {processos[indice].exitcode})",
+            }
+
+# Função para enviar a fila (ou só uma campanha) com N processos, relatando o progresso
+# Retorna (enviados, falhas, erros de worker)
+def enviar_fila(relator, workers=1, limite=None, campanha_id=None):
+    contexto = multiprocessing.get_context("spawn")
+    restantes = contexto.Value("q", limite if limite else -1)
+    eventos = contexto.Queue()
+    processos = [
+        contexto.Process(target=_executar_worker_lote, args=(indice, campanha_id, restantes, eventos))
+        for indice in range(max(1, workers))
+    ]
+    for processo in processos:
+        processo.start()
+
+    enviados = falhas = erros = 0
+    ativos = set(range(len(processos)))
+    inicio = time.perf_counter()
+    while ativos:
+        evento = _proximo_evento(eventos, processos, ativos)
+        if evento["evento"] == "fim":
+            ativos.discard(evento["indice"])
+        elif evento["evento"] == "morto":
+            ativos.discard(evento["indice"])
+            erros += 1
+            relator.emitir("erro", worker=evento["worker"], erro=evento["erro"])
+        elif evento["evento"] == "erro":
+            erros += 1
+            relator.emitir("erro", worker=evento["worker"], erro=evento["erro"])
+        else:
+            enviados += evento["enviados"]
+            falhas += evento["falhas"]
+            duracao = time.perf_counter() - inicio
+            relator.emitir(
+                "progresso",
+                enviados=enviados,
+                falhas=falhas,
+                emails_por_segundo=enviados / duracao if duracao > 0 else 0.0
+            )
+    for processo in processos:
+        processo.join()
+    return enviados, falhas, erros
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Envio de e-mails em lote sem o Streamlit")
+    parser.add_argument("--arquivo", help="CSV ou XLSX de destinatários; sem ele, envia os e-mails já aprovados")
+    parser.add_argument("--assunto", help="Assunto (obrigatório com --arquivo)")
+    parser.add_argument("--modelo", help="Arquivo HTML do modelo, com campos {{ Coluna }} (obrigatório com --arquivo)")
+    parser.add_argument("--remetente", default=SMTP_USER, help="Remetente registrado nas linhas do arquivo")
+    parser.add_argument("--campanha", type=int, help="Envia só os aprovados desta campanha")
+    parser.add_argument("--workers", type=int, default=1, help="Processos de envio em paralelo")
+    parser.add_argument("--limit", type=int, help="Máximo de e-mails nesta execução")
+    parser.add_argument("--dry-run", action="store_true", help="Valida e mostra o que seria enviado, sem gravar nem enviar")
+    parser.add_argument("--json", action="store_true", help="Progresso em linhas JSON")
+    args = parser.parse_args(argv)
+    relator = Relator(args.json)
+
+    campanha_id = args.campanha
+    try:
+        if args.arquivo:
+            if not args.assunto or not args.modelo:
+                parser.error("--assunto e --modelo são obrigatórios com --arquivo")
+            with open(args.modelo, encoding="utf-8") as arquivo:
+                modelo = compilar_modelo(arquivo.read())
+
+            destinatarios = ler_destinatarios(args.arquivo, args.limit)
+            primeiro = next(destinatarios, None)
+            if primeiro is None:
+                relator.emitir("resumo", enviados=0, falhas=0, mensagem="Arquivo sem destinatários")
+                return SAIDA_OK
+            modelo.validar(list(primeiro.keys()) + [CAMPO_RASTREAMENTO])
+            destinatarios = (linha for bloco in ([primeiro], destinatarios) for linha in bloco)
+
+            if args.dry_run:
+                total = sum(1 for _ in destinatarios)
+                previa = modelo.renderizar({**primeiro, CAMPO_RASTREAMENTO: ""}, parcial=True)
+                relator.emitir("dry_run", emails=total, assunto=args.assunto, previa=previa[:500])
+                return SAIDA_OK
+
+            # Antes de gravar: linhas enfileiradas sem uma conta de envio ficariam paradas na fila
+            verificar_credenciais_smtp()
+            verificar_esquema()
+            campanha_id, total = enfileirar_arquivo(
+                args.remetente, args.assunto, modelo, destinatarios, f"cli:{getpass.getuser()}"
+            )
+            relator.emitir("enfileirado", campanha_id=campanha_id, emails=total)
+        elif args.dry_run:
+            grupos = resumo_fila(campanha_id)
+            total = sum(grupo["emails"] for grupo in grupos)
+            relator.emitir("dry_run", emails=min(total, args.limit) if args.limit else total, grupos=grupos)
+            return SAIDA_OK
+        else:
+            verificar_credenciais_smtp()
+            verificar_esquema()
+            recuperados = recuperar_travados()
+            if recuperados:
+                relator.emitir("recuperados", emails=recuperados)
+    except (OSError, ValueError, KeyError) as e:
+        relator.emitir("erro", erro=str(e))
+        return SAIDA_ENTRADA_INVALIDA
+    except Exception as e:
+        relator.emitir("erro", erro=str(e))
+        return SAIDA_ERRO
+
+    inicio = time.perf_counter()
+    enviados, falhas, erros = enviar_fila(relator, args.workers, args.limit, campanha_id)
+    duracao = time.perf_counter() - inicio
+    relator.emitir(
+        "resumo",
+        enviados=enviados,
+        falhas=falhas,
+        erros_worker=erros,
+        duracao=round(duracao, 1),
+        emails_por_segundo=round(enviados / duracao, 2) if duracao > 0 else 0.0
+    )
+    if erros:
+        return SAIDA_ERRO
+    return SAIDA_FALHAS if falhas else SAIDA_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
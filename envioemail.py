@@ -1,14 +1,16 @@
 import streamlit as st
 import pandas as pd
-import requests
 import os
 import psycopg2
 from dotenv import load_dotenv
-from minio import Minio
 from minio.error import S3Error
 from urllib3.exceptions import InsecureRequestWarning
 import urllib3
-import uuid
+from armazenamento import (
+    obter_minio, garantir_bucket, iniciar_verificacao_minio, MINIO_BUCKET_NAME,
+    registrar_ultimo_objeto, enviar_anexo
+)
+from webhook_n8n import despachar_webhook, dividir_em_lotes
 
 # Desabilita os avisos de SSL inseguros
 urllib3.disable_warnings(InsecureRequestWarning)
@@ -22,14 +24,7 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 
-# Configuração do webhook do n8n
-N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL")  # Defina a URL do webhook como variável de ambiente
-
-# Configuração do MinIO
-MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
-MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY")
-MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY")
-MINIO_BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME")
+# Configuração do webhook do n8n (URL, tamanho dos lotes e paralelismo): ver webhook_n8n.py
 
 # Configuração do banco de dados PostgreSQL
 DB_HOST = os.getenv("DB_HOST")
@@ -38,92 +33,38 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
-# Inicializa o cliente do MinIO
-minio_client = Minio(
-    MINIO_ENDPOINT.strip(),
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    secure=True,  # HTTPS
-    http_client=urllib3.PoolManager(cert_reqs='CERT_NONE')  # Ignora a verificação do certificado
-)
-
-try:
-    # Lista os buckets para verificar a conexão
-    buckets = minio_client.list_buckets()
-    print("Conexão bem-sucedida. Buckets disponíveis:")
-    for bucket in buckets:
-        print(bucket.name)
-except Exception as e:
-    print(f"Erro ao conectar ao MinIO: {e}")
+# Verifica a conexão com o MinIO em segundo plano (uma vez por processo, não a cada interação)
+iniciar_verificacao_minio()
 
 # Função para enviar arquivo para o MinIO
 def enviar_para_minio(file_data, file_name, content_type):
     try:
         # Verifica se o bucket existe
-        if not minio_client.bucket_exists(MINIO_BUCKET_NAME):
-            minio_client.make_bucket(MINIO_BUCKET_NAME)
+        garantir_bucket(MINIO_BUCKET_NAME)
 
         # Envia o arquivo para o MinIO
-        minio_client.put_object(
+        obter_minio().put_object(
             MINIO_BUCKET_NAME,
             file_name,
             file_data,
             length=len(file_data.getvalue()),
             content_type=content_type
         )
+        registrar_ultimo_objeto(MINIO_BUCKET_NAME, file_name)
         return f"Arquivo {file_name} enviado com sucesso para o MinIO!"
     except S3Error as e:
         print(f"Erro ao enviar arquivo para o MinIO: {e}")
         return None
 
 # Função para enviar arquivo para o MinIO com identificação única
+# O nome do objeto vem do conteúdo: o mesmo boleto enviado a vários destinatários é guardado uma vez
 def enviar_para_minio_com_identificacao(file_data, recipient_email, content_type):
     try:
-        # Gera um nome de arquivo único usando o e-mail do destinatário e um UUID
-        unique_id = str(uuid.uuid4())
-        file_name = f"{recipient_email}_{unique_id}.pdf"
-
-        # Verifica se o bucket existe
-        if not minio_client.bucket_exists(MINIO_BUCKET_NAME):
-            minio_client.make_bucket(MINIO_BUCKET_NAME)
-
-        # Envia o arquivo para o MinIO
-        minio_client.put_object(
-            MINIO_BUCKET_NAME,
-            file_name,
-            file_data,
-            length=len(file_data.getvalue()),
-            content_type=content_type
-        )
-
-        # Gera o link público para o arquivo
-        link = minio_client.presigned_get_object(MINIO_BUCKET_NAME, file_name)
-        return link
+        return enviar_anexo(file_data, content_type)
     except S3Error as e:
         print(f"Erro ao enviar arquivo para o MinIO: {e}")
         return None
 
-# Função para obter o link do último item adicionado ao bucket
-def obter_link_ultimo_item(bucket_name):
-    try:
-        # Lista todos os objetos no bucket
-        objects = minio_client.list_objects(bucket_name, recursive=True)
-
-        # Encontra o objeto mais recente
-        ultimo_objeto = max(objects, key=lambda obj: obj.last_modified)
-
-        # Gera o link público para o objeto
-        link = minio_client.presigned_get_object(bucket_name, ultimo_objeto.object_name)
-        return link
-    except Exception as e:
-        print(f"Erro ao obter o último item do bucket: {e}")
-        return None
-
-# Exemplo de uso
-link_ultimo_item = obter_link_ultimo_item(MINIO_BUCKET_NAME)
-if link_ultimo_item:
-    print(f"Link do último item adicionado: {link_ultimo_item}")
-
 # Função para verificar login
 def verificar_login(email, senha):
     try:
@@ -204,6 +145,37 @@ def tela_login():
             else:
                 st.error("E-mail ou senha inválidos.")
 
+# Função para enviar o envio em massa guardado na sessão ao n8n, em lotes, mostrando o status de cada lote
+def enviar_para_webhook(lotes=None):
+    envio = st.session_state["envio_webhook"]
+    total_lotes = len(dividir_em_lotes(envio["email_list"])) if lotes is None else len(lotes)
+    barra = st.progress(0.0, text="Enviando lotes ao n8n...")
+    tabela = st.empty()
+    concluidos = []
+
+    def ao_concluir(resultado):
+        concluidos.append(resultado)
+        barra.progress(len(concluidos) / total_lotes, text=f"{len(concluidos)} de {total_lotes} lotes concluídos")
+        tabela.dataframe(
+            pd.DataFrame(concluidos)[["lote", "destinatarios", "status", "codigo_http", "tentativas", "erro"]],
+            use_container_width=True
+        )
+
+    try:
+        id_envio, resultados = despachar_webhook(
+            envio["payload"], envio["email_list"], id_envio=envio["id"], lotes=lotes, ao_concluir=ao_concluir
+        )
+    except Exception as e:
+        st.error(f"Erro ao conectar ao webhook: {e}")
+        return
+
+    envio["id"] = id_envio
+    envio["falhas"] = [resultado["lote"] for resultado in resultados if resultado["status"] != "enviado"]
+    if envio["falhas"]:
+        st.error(f"Erro ao enviar {len(envio['falhas'])} de {len(resultados)} lotes.")
+    else:
+        st.success("E-mails enviados com sucesso!")
+
 # Tela principal
 def tela_principal():
     # Exibe o e-mail do usuário logado
@@ -246,23 +218,23 @@ def tela_principal():
                             "subject": subject,
                             "body": body,
                             "email_user": st.session_state["usuario"],
-                            "email_list": email_list,
                             "type": "mass_email",
                         }
-                        try:
-                            # Envia os dados para o webhook do n8n
-                            response = requests.post(N8N_WEBHOOK_URL, json=payload, verify=False)
-                            if response.status_code == 200:
-                                st.success("E-mails enviados com sucesso!")
-                            else:
-                                st.error(f"Erro ao enviar e-mails: {response.text}")
-                        except Exception as e:
-                            st.error(f"Erro ao conectar ao webhook: {e}")
+                        # Novo envio: novo identificador (as chaves de idempotência dos lotes derivam dele)
+                        st.session_state["envio_webhook"] = {"id": None, "payload": payload, "email_list": email_list}
+                        enviar_para_webhook()
                     else:
                         st.error("Por favor, preencha todos os campos da tabela.")
                 else:
                     st.warning("Por favor, preencha todos os campos obrigatórios.")
 
+            # Lotes que falharam podem ser reenviados com as mesmas chaves, sem repetir os que já foram
+            envio = st.session_state.get("envio_webhook")
+            if envio and envio.get("falhas"):
+                st.warning(f"{len(envio['falhas'])} lote(s) não foram entregues ao n8n.")
+                if st.button("Reenviar lotes com falha", key="mass_retry_button"):
+                    enviar_para_webhook(envio["falhas"])
+
         # Aba 2: Envio Único
         # with tab2:
         #     st.header("Envio de E-mail Único")
@@ -2,20 +2,33 @@ import streamlit as st
 import pandas as pd
 import requests
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, Json, execute_values
 from dotenv import load_dotenv
-from minio import Minio
 from minio.error import S3Error
 from urllib3.exceptions import InsecureRequestWarning
 import urllib3
 import uuid
-import smtplib
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime
+from datetime import datetime, timedelta
 import bcrypt  # Importa a biblioteca para hashing de senhas
 from pytz import timezone
+from banco import conexao, DB_BULK_CHUNK, estatisticas_pool
+from smtp_sessoes import obter_sessao_smtp
+from armazenamento import (
+    obter_minio, garantir_bucket, iniciar_verificacao_minio, MINIO_BUCKET_NAME,
+    registrar_ultimo_objeto, enviar_anexo,
+    estado_minio, estatisticas_links
+)
+from fila_envio import (
+    enfileirar_emails, enfileirar_pendentes, metricas_workers, progresso_fila, progresso_fila_por_grupo
+)
+from modelo_email import compilar_modelo, CAMPO_RASTREAMENTO
+from campanhas import criar_campanha, obter_previa_campanha, obter_previa_email
+from cache_equipe import cache_equipe, estatisticas_cache
+from metricas_envio import instantaneo, iniciar_servidor_metricas
+from migracoes import verificar_esquema
 
 # Desabilita os avisos de SSL inseguros
 urllib3.disable_warnings(InsecureRequestWarning)
@@ -32,121 +45,58 @@ st.set_page_config(
 # Configuração do webhook do n8n
 N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL")  # Defina a URL do webhook como variável de ambiente
 
-# Configuração do MinIO
-MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
-MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY")
-MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY")
-MINIO_BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME")
-
-# Configuração do banco de dados PostgreSQL
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-# Inicializa o cliente do MinIO
-minio_client = Minio(
-    MINIO_ENDPOINT.strip(),
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    secure=True,  # HTTPS
-    http_client=urllib3.PoolManager(cert_reqs='CERT_NONE')  # Ignora a verificação do certificado
-)
+# Verifica a conexão com o MinIO em segundo plano (uma vez por processo, não a cada interação)
+iniciar_verificacao_minio()
 
+# Confere (uma vez por processo) se as migrações foram aplicadas com python migracoes.py
 try:
-    # Lista os buckets para verificar a conexão
-    buckets = minio_client.list_buckets()
-    print("Conexão bem-sucedida. Buckets disponíveis:")
-    for bucket in buckets:
-        print(bucket.name)
+    verificar_esquema()
 except Exception as e:
-    print(f"Erro ao conectar ao MinIO: {e}")
+    st.error(f"Erro ao verificar o esquema do banco de dados: {e}")
+
+# Endpoint /metrics do processo do painel (só com METRICAS_PORTA definida)
+iniciar_servidor_metricas()
 
 # Função para enviar arquivo para o MinIO
 def enviar_para_minio(file_data, file_name, content_type):
     try:
         # Verifica se o bucket existe
-        if not minio_client.bucket_exists(MINIO_BUCKET_NAME):
-            minio_client.make_bucket(MINIO_BUCKET_NAME)
+        garantir_bucket(MINIO_BUCKET_NAME)
 
         # Envia o arquivo para o MinIO
-        minio_client.put_object(
+        obter_minio().put_object(
             MINIO_BUCKET_NAME,
             file_name,
             file_data,
             length=len(file_data.getvalue()),
             content_type=content_type
         )
+        registrar_ultimo_objeto(MINIO_BUCKET_NAME, file_name)
         return f"Arquivo {file_name} enviado com sucesso para o MinIO!"
     except S3Error as e:
         print(f"Erro ao enviar arquivo para o MinIO: {e}")
         return None
 
 # Função para enviar arquivo para o MinIO com identificação única
+# O nome do objeto vem do conteúdo: o mesmo boleto enviado a vários destinatários é guardado uma vez
 def enviar_para_minio_com_identificacao(file_data, recipient_email, content_type):
     try:
-        # Gera um nome de arquivo único usando o e-mail do destinatário e um UUID
-        unique_id = str(uuid.uuid4())
-        file_name = f"{recipient_email}_{unique_id}.pdf"
-
-        # Verifica se o bucket existe
-        if not minio_client.bucket_exists(MINIO_BUCKET_NAME):
-            minio_client.make_bucket(MINIO_BUCKET_NAME)
-
-        # Envia o arquivo para o MinIO
-        minio_client.put_object(
-            MINIO_BUCKET_NAME,
-            file_name,
-            file_data,
-            length=len(file_data.getvalue()),
-            content_type=content_type
-        )
-
-        # Gera o link público para o arquivo
-        link = minio_client.presigned_get_object(MINIO_BUCKET_NAME, file_name)
-        return link
+        return enviar_anexo(file_data, content_type)
     except S3Error as e:
         print(f"Erro ao enviar arquivo para o MinIO: {e}")
         return None
 
-# Função para obter o link do último item adicionado ao bucket
-def obter_link_ultimo_item(bucket_name):
-    try:
-        # Lista todos os objetos no bucket
-        objects = minio_client.list_objects(bucket_name, recursive=True)
-
-        # Encontra o objeto mais recente
-        ultimo_objeto = max(objects, key=lambda obj: obj.last_modified)
-
-        # Gera o link público para o objeto
-        link = minio_client.presigned_get_object(bucket_name, ultimo_objeto.object_name)
-        return link
-    except Exception as e:
-        print(f"Erro ao obter o último item do bucket: {e}")
-        return None
-
-# Exemplo de uso
-# link_ultimo_item = obter_link_ultimo_item(MINIO_BUCKET_NAME)
-# if link_ultimo_item:
-#     print(f"Link do último item adicionado: {link_ultimo_item}")
-
 # Função para verificar login
 def verificar_login(email, senha):
     try:
-        # Conexão com o banco de dados
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cursor = conn.cursor()
-        # Consulta para verificar as credenciais
-        query = 'SELECT "Senha" FROM "Equipe_Completa" WHERE "EMAIL" = %s'
-        cursor.execute(query, (email,))
-        result = cursor.fetchone()
+        # Conexão emprestada do pool (devolvida mesmo nos retornos antecipados)
+        with conexao() as conn:
+            cursor = conn.cursor()
+            # Consulta para verificar as credenciais
+            query = 'SELECT "Senha" FROM "Equipe_Completa" WHERE "EMAIL" = %s'
+            cursor.execute(query, (email,))
+            result = cursor.fetchone()
+            cursor.close()
 
         if result:
             senha_armazenada = result[0]
@@ -160,8 +110,6 @@ def verificar_login(email, senha):
                 if senha == senha_armazenada:
                     return True
 
-        cursor.close()
-        conn.close()
         return False  # Credenciais inválidas
     except Exception as e:
         st.error(f"Erro ao conectar ao banco de dados: {e}")
@@ -170,87 +118,107 @@ def verificar_login(email, senha):
 # Função para alterar a senha
 def alterar_senha(email, senha_atual, nova_senha):
     try:
-        # Conexão com o banco de dados
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cursor = conn.cursor()
-
-        # Verifica se a senha atual está correta
-        query_verificar = 'SELECT "Senha" FROM "Equipe_Completa" WHERE "EMAIL" = %s'
-        cursor.execute(query_verificar, (email,))
-        result = cursor.fetchone()
-
-        if result:
-            senha_armazenada = result[0]
-            # Verifica se a senha armazenada é um hash do bcrypt
-            if senha_armazenada.startswith("$2b$"):
-                if not bcrypt.checkpw(senha_atual.encode('utf-8'), senha_armazenada.encode('utf-8')):
-                    cursor.close()
-                    conn.close()
-                    return False  # Senha atual incorreta
+        with conexao() as conn:
+            cursor = conn.cursor()
+
+            # Verifica se a senha atual está correta
+            query_verificar = 'SELECT "Senha" FROM "Equipe_Completa" WHERE "EMAIL" = %s'
+            cursor.execute(query_verificar, (email,))
+            result = cursor.fetchone()
+
+            if result:
+                senha_armazenada = result[0]
+                # Verifica se a senha armazenada é um hash do bcrypt
+                if senha_armazenada.startswith("$2b$"):
+                    if not bcrypt.checkpw(senha_atual.encode('utf-8'), senha_armazenada.encode('utf-8')):
+                        return False  # Senha atual incorreta
+                else:
+                    # Senha armazenada não está no formato bcrypt (senha antiga)
+                    if senha_atual != senha_armazenada:
+                        return False  # Senha atual incorreta
+
+                # Criptografa a nova senha
+                nova_senha_hash = bcrypt.hashpw(nova_senha.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+                # Atualiza a senha no banco de dados
+                query_atualizar = 'UPDATE "Equipe_Completa" SET "Senha" = %s WHERE "EMAIL" = %s'
+                cursor.execute(query_atualizar, (nova_senha_hash, email))
+                conn.commit()
+                cursor.close()
+                return True  # Senha alterada com sucesso
             else:
-                # Senha armazenada não está no formato bcrypt (senha antiga)
-                if senha_atual != senha_armazenada:
-                    cursor.close()
-                    conn.close()
-                    return False  # Senha atual incorreta
-
-            # Criptografa a nova senha
-            nova_senha_hash = bcrypt.hashpw(nova_senha.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-
-            # Atualiza a senha no banco de dados
-            query_atualizar = 'UPDATE "Equipe_Completa" SET "Senha" = %s WHERE "EMAIL" = %s'
-            cursor.execute(query_atualizar, (nova_senha_hash, email))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True  # Senha alterada com sucesso
-        else:
-            cursor.close()
-            conn.close()
-            return False  # Usuário não encontrado
+                return False  # Usuário não encontrado
     except Exception as e:
         st.error(f"Erro ao conectar ao banco de dados: {e}")
         return False
 
-# Função para hospedar a imagem de rastreamento no MinIO com nome único
-def hospedar_imagem_rastreamento(file_name):
-    try:
-        # Nome do bucket
-        bucket_name = "rastreiaemail"
-
-        # Verifica se o bucket existe
-        if not minio_client.bucket_exists(bucket_name):
-            minio_client.make_bucket(bucket_name)
-
-        # Cria uma imagem de 1x1 pixel
-        from io import BytesIO
-        from PIL import Image
-        img = Image.new("RGB", (1, 1), color=(255, 255, 255))
-        img_data = BytesIO()
-        img.save(img_data, format="PNG")
-        img_data.seek(0)
-
-        # Envia a imagem para o MinIO
-        minio_client.put_object(
-            bucket_name,
-            file_name,
-            img_data,
-            length=img_data.getbuffer().nbytes,
-            content_type="image/png"
-        )
+# Função para montar os filtros de rastreamento_emails usados no rastreamento e na aprovação
+# Os nomes são convertidos em e-mails antes da consulta e a data vira um intervalo [dia, dia seguinte),
+# o que permite ao PostgreSQL usar os índices de remetente, destinatario e data_envio
+def montar_filtros_rastreamento(filtro_avancado, filtro_assistente, filtro_data):
+    filtros = ""
+    params = []
+    if filtro_avancado != "Todos":
+        filtros += " AND remetente = ANY(%s)"
+        params.append(_buscar_emails_colaborador(filtro_avancado))
+    if filtro_assistente != "Todos":
+        filtros += " AND destinatario = ANY(%s)"
+        params.append(_buscar_emails_colaborador(filtro_assistente))
+    if filtro_data:
+        inicio_dia = datetime.combine(filtro_data, datetime.min.time())
+        filtros += " AND data_envio >= %s AND data_envio < %s"
+        params.extend([inicio_dia, inicio_dia + timedelta(days=1)])
+    return filtros, params
+
+# Função para buscar uma página de rastreamento_emails por keyset em (data_envio, id)
+# `query` deve selecionar data_envio e id e terminar na cláusula WHERE; a posição de cada página
+# visitada fica na sessão, então nenhuma página exige ler as anteriores (sem OFFSET)
+def paginar_keyset(query, params, chave):
+    col1, col2 = st.columns(2)
+    ordem = col1.selectbox("Ordenar por data", ["Mais recentes", "Mais antigos"], key=f"{chave}_ordem")
+    opcoes_tamanho = sorted({50, 100, 500, TAMANHO_PAGINA})
+    tamanho = col2.selectbox(
+        "Linhas por página", opcoes_tamanho, index=opcoes_tamanho.index(TAMANHO_PAGINA), key=f"{chave}_tamanho"
+    )
+    decrescente = ordem == "Mais recentes"
+
+    # Qualquer mudança de filtro, ordem ou tamanho volta para a primeira página
+    assinatura = (query, tuple(str(param) for param in params), decrescente, tamanho)
+    if st.session_state.get(f"{chave}_assinatura") != assinatura:
+        st.session_state[f"{chave}_assinatura"] = assinatura
+        st.session_state[f"{chave}_cursores"] = [None]
+    cursores = st.session_state[f"{chave}_cursores"]
+
+    direcao, comparacao = ("DESC", "<") if decrescente else ("ASC", ">")
+    query_pagina = query
+    params_pagina = list(params)
+    if cursores[-1] is not None:
+        query_pagina += f" AND (data_envio, id) {comparacao} (%s, %s)"
+        params_pagina.extend(cursores[-1])
+    query_pagina += f" ORDER BY data_envio {direcao}, id {direcao} LIMIT %s"
+    params_pagina.append(tamanho + 1)  # Uma linha a mais indica se existe próxima página
+
+    with conexao() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(query_pagina, tuple(params_pagina))
+        linhas = cursor.fetchall()
+        cursor.close()
+    # As linhas da página podem ter mudado de status desde a navegação: volta para a página anterior
+    if not linhas and len(cursores) > 1:
+        cursores.pop()
+        st.rerun()
+    tem_proxima = len(linhas) > tamanho
+    linhas = linhas[:tamanho]
 
-        # Gera o link público para a imagem
-        link = minio_client.presigned_get_object(bucket_name, file_name)
-        return link
-    except Exception as e:
-        st.error(f"Erro ao hospedar a imagem de rastreamento: {e}")
-        return None
+    col1, col2, col3 = st.columns([1, 2, 1])
+    if col1.button("◀ Anterior", disabled=len(cursores) == 1, key=f"{chave}_anterior"):
+        cursores.pop()
+        st.rerun()
+    col2.write(f"Página {len(cursores)}")
+    if col3.button("Próxima ▶", disabled=not tem_proxima, key=f"{chave}_proxima"):
+        cursores.append((linhas[-1]["data_envio"], linhas[-1]["id"]))
+        st.rerun()
+    return linhas
 
 # Função para exibir os dados de rastreamento com filtros e métricas
 def exibir_dados_rastreamento():
@@ -271,60 +239,48 @@ def exibir_dados_rastreamento():
         key="filtro_data_rastreamento"
     )
 
-    # Conexão com o banco de dados para buscar os dados de rastreamento
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-        # Consulta para buscar os dados de rastreamento
-        query = """
-        SELECT data_envio, remetente, destinatario, status, data_abertura
+        filtros, params = montar_filtros_rastreamento(filtro_avancado, filtro_assistente, filtro_data)
+
+        # Métricas calculadas no banco, em uma única passada
+        query_metricas = f"""
+        SELECT
+            COUNT(*) AS total_enviados,
+            COUNT(*) FILTER (WHERE status = 'Aberto') AS total_lidos,
+            COUNT(*) FILTER (WHERE status = 'Não Aberto') AS total_nao_lidos
         FROM rastreamento_emails
-        WHERE status IN ('Aberto', 'Não Aberto')
+        WHERE status IN ('Aberto', 'Não Aberto'){filtros}
         """
-        params = []
+        with conexao() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(query_metricas, tuple(params))
+            metricas = cursor.fetchone()
+            cursor.close()
 
-        # Aplica os filtros
-        if filtro_avancado != "Todos":
-            query += ' AND remetente IN (SELECT "EMAIL" FROM "Equipe_Completa" WHERE "Nome_Colaborador" = %s)'
-            params.append(filtro_avancado)
-        if filtro_assistente != "Todos":
-            query += ' AND destinatario IN (SELECT "EMAIL" FROM "Equipe_Completa" WHERE "Nome_Colaborador" = %s)'
-            params.append(filtro_assistente)
-        if filtro_data:
-            query += ' AND DATE("data_envio") = %s'
-            params.append(filtro_data)
-
-        cursor.execute(query, tuple(params))
-        rastreamento = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        if metricas["total_enviados"]:
+            # Exibe as métricas
+            col1, col2, col3 = st.columns(3)
+            col1.metric("E-mails Enviados", metricas["total_enviados"])
+            col2.metric("E-mails Lidos", metricas["total_lidos"])
+            col3.metric("E-mails Não Lidos", metricas["total_nao_lidos"])
+
+            # Busca somente a página de detalhes exibida
+            query = f"""
+            SELECT id, data_envio, remetente, destinatario, status, data_abertura
+            FROM rastreamento_emails
+            WHERE status IN ('Aberto', 'Não Aberto'){filtros}
+            """
+            rastreamento = paginar_keyset(query, params, "rastreamento")
 
-        if rastreamento:
-            # Converte os dados em um DataFrame
-            df = pd.DataFrame(rastreamento)
+            # Converte os dados em um DataFrame (colunas explícitas: a página pode vir vazia)
+            df = pd.DataFrame(
+                rastreamento, columns=["id", "data_envio", "remetente", "destinatario", "status", "data_abertura"]
+            )
 
             # Converte as datas para o fuso horário do Brasil
             df["data_envio"] = pd.to_datetime(df["data_envio"]).dt.tz_localize("UTC").dt.tz_convert("America/Sao_Paulo")
             df["data_abertura"] = pd.to_datetime(df["data_abertura"]).dt.tz_localize("UTC").dt.tz_convert("America/Sao_Paulo")
 
-            # Calcula as métricas
-            total_enviados = len(df)
-            total_lidos = len(df[df["status"] == "Aberto"])
-            total_nao_lidos = len(df[df["status"] == "Não Aberto"])
-
-            # Exibe as métricas
-            col1, col2, col3 = st.columns(3)
-            col1.metric("E-mails Enviados", total_enviados)
-            col2.metric("E-mails Lidos", total_lidos)
-            col3.metric("E-mails Não Lidos", total_nao_lidos)
-
             # Exibe os dados de rastreamento
             st.write("Dados de Rastreamento:")
             st.dataframe(df[["data_envio", "remetente", "destinatario", "status", "data_abertura"]], use_container_width=True)
@@ -333,131 +289,63 @@ def exibir_dados_rastreamento():
     except Exception as e:
         st.error(f"Erro ao carregar os dados de rastreamento: {e}")
 
-# Função para enviar e-mails em massa usando SMTP do Office 365
-def enviar_emails_smtp(subject, body_html, email_list, email_user, email_password):
-    try:
-        # Configuração do servidor SMTP do Office 365
-        smtp_server = "smtp.office365.com"
-        smtp_port = 587
-
-        # Conexão com o servidor SMTP
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()  # Inicia a conexão segura
-
-        try:
-            server.login(email_user, email_password)  # Autenticação
-        except smtplib.SMTPAuthenticationError:
-            st.error("Erro de autenticação no servidor SMTP. Verifique o e-mail e a senha.")
-            return False
-
-        # Envia e-mails para cada destinatário
-        for recipient in email_list:
-            msg = MIMEMultipart("alternative")
-            msg["From"] = email_user
-            msg["To"] = recipient["Email"]
-            msg["Subject"] = subject
-
-            # Gera um ID único para rastreamento
-            id_rastreamento = str(uuid.uuid4())
-
-            # Gera o link da imagem de rastreamento para o destinatário
-            link_rastreamento = hospedar_imagem_rastreamento(f"{id_rastreamento}.png")
-
-            # Personaliza o HTML com o nome do destinatário e o link de rastreamento
-            body_personalizado = body_html.replace("Nome-RU", recipient["Nome-RU"])
-            body_personalizado = body_personalizado.replace("rastreamento_url", link_rastreamento)
-
-            # Adiciona o corpo do e-mail em HTML
-            msg.attach(MIMEText(body_personalizado, "html"))
-
-            # Envia o e-mail
-            server.sendmail(email_user, recipient["Email"], msg.as_string())
-
-            # Registra o envio no banco de dados
-            registrar_envio_email(
-                email_user,
-                recipient["Email"],
-                recipient["Nome-RU"],
-                subject,
-                body_personalizado,
-                id_rastreamento
-            )
-
-        server.quit()  # Fecha a conexão com o servidor
-        st.rerun()
-        return True
-    except Exception as e:
-        st.error(f"Erro ao enviar e-mails: {e}")
-        return False
-
 # Define o fuso horário do Brasil
 fuso_horario_brasil = timezone("America/Sao_Paulo")
 
-# Função para registrar o envio de e-mails no banco de dados
-def registrar_envio_email(remetente, destinatario, nome_destinatario, assunto, corpo, id_rastreamento):
-    try:
-        # Conexão com o banco de dados
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cursor = conn.cursor()
-
-        # Obtém a data e hora atual no fuso horário do Brasil
-        data_envio = datetime.now(fuso_horario_brasil)
-
-        # Inserir os dados do envio no banco
-        query = """
-        INSERT INTO rastreamento_emails (remetente, destinatario, nome_destinatario, assunto, corpo, id_rastreamento, data_envio)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(query, (remetente, destinatario, nome_destinatario, assunto, corpo, id_rastreamento, data_envio))
-        conn.commit()
-
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        st.error(f"Erro ao registrar o envio no banco de dados: {e}")
+# Linhas de detalhe carregadas por página nas telas de rastreamento e aprovação
+TAMANHO_PAGINA = int(os.getenv("TAMANHO_PAGINA", "100"))
 
 # Função para salvar os e-mails pendentes no banco de dados
-def salvar_emails_pendentes(email_user, email_list, subject, body_html):
+# Retorna a quantidade de linhas gravadas e a taxa (linhas/segundo), ou None em caso de erro
+def salvar_emails_pendentes(email_user, email_list, subject, body_html, tamanho_lote=DB_BULK_CHUNK):
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cursor = conn.cursor()
+        inicio = time.perf_counter()
 
-        # Insere os e-mails pendentes no banco de dados
+        # Insere os e-mails pendentes em lote: cada comando leva até `tamanho_lote` linhas no VALUES
         query = """
-        INSERT INTO rastreamento_emails (remetente, destinatario, nome_destinatario, assunto, corpo, id_rastreamento, status)
-        VALUES (%s, %s, %s, %s, %s, %s, 'Pendente')
+        INSERT INTO rastreamento_emails (remetente, destinatario, nome_destinatario, assunto, campanha_id, valores, id_rastreamento, status)
+        VALUES %s
         """
-        for recipient in email_list:
-            id_rastreamento = str(uuid.uuid4())
-            cursor.execute(query, (
-                email_user,
-                recipient["Email"],
-                recipient["Nome-RU"],
-                subject,
-                body_html.replace("{{ Nome-RU }}", recipient["Nome-RU"]),
-                id_rastreamento
-            ))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        # Valida o modelo uma vez; cada linha guarda apenas os valores dos campos do destinatário
+        modelo = compilar_modelo(body_html)
+        with conexao() as conn:
+            cursor = conn.cursor()
+            campanha_id = criar_campanha(cursor, email_user, subject, modelo.texto)
+            linhas = [
+                (
+                    email_user,
+                    recipient["Email"],
+                    recipient["Nome-RU"],
+                    subject,
+                    campanha_id,
+                    Json({campo: recipient.get(campo) for campo in modelo.campos if campo in recipient}),
+                    str(uuid.uuid4()),
+                )
+                for recipient in email_list
+            ]
+            execute_values(
+                cursor,
+                query,
+                linhas,
+                template="(%s, %s, %s, %s, %s, %s, %s, 'Pendente')",
+                page_size=tamanho_lote
+            )
+            # Um único commit: a campanha é gravada inteira ou não é gravada
+            conn.commit()
+            cursor.close()
+
+        duracao = time.perf_counter() - inicio
+        taxa = len(linhas) / duracao if duracao > 0 else float(len(linhas))
+        print(f"{len(linhas)} e-mails pendentes gravados em {duracao:.2f}s ({taxa:.0f} linhas/s)")
+        return len(linhas), taxa
     except Exception as e:
         st.error(f"Erro ao salvar e-mails pendentes: {e}")
+        return None
 
 # Função para exibir a tela de aprovação com filtros e seleção de mensagens
 def tela_aprovacao():
     st.header("Aprovação de E-mails")
+    exibir_progresso_fila()
     filtro_avancado = st.selectbox(
         "Filtrar por Avançado", 
         ["Todos"] + obter_lista_avancados(), 
@@ -474,50 +362,40 @@ def tela_aprovacao():
         key="filtro_data_aprovacao"
     )
 
-    # Conexão com o banco de dados para buscar os e-mails pendentes
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        # Aplica os filtros
+        filtros, params = montar_filtros_rastreamento(filtro_avancado, filtro_assistente, filtro_data)
 
-        # Consulta para buscar os e-mails pendentes
-        query = """
-        SELECT id, remetente, destinatario, nome_destinatario, assunto, corpo, data_envio
-        FROM rastreamento_emails
-        WHERE status = 'Pendente'
-        """
-        params = []
+        # Total de pendentes no filtro, contado no banco
+        with conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COUNT(*) FROM rastreamento_emails WHERE status = 'Pendente'{filtros}", tuple(params))
+            total_pendentes = cursor.fetchone()[0]
+            cursor.close()
 
-        # Aplica os filtros
-        if filtro_avancado != "Todos":
-            query += ' AND remetente IN (SELECT "EMAIL" FROM "Equipe_Completa" WHERE "Nome_Colaborador" = %s)'
-            params.append(filtro_avancado)
-        if filtro_assistente != "Todos":
-            query += ' AND destinatario IN (SELECT "EMAIL" FROM "Equipe_Completa" WHERE "Nome_Colaborador" = %s)'
-            params.append(filtro_assistente)
-        if filtro_data:
-            query += ' AND DATE("data_envio") = %s'
-            params.append(filtro_data)
-
-        cursor.execute(query, tuple(params))
-        emails_pendentes = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        if total_pendentes:
+            st.write(f"E-mails Pendentes de Aprovação: {total_pendentes}")
 
-        if emails_pendentes:
-            st.write("E-mails Pendentes de Aprovação:")
-            df = pd.DataFrame(emails_pendentes)
+            # Consulta para buscar a página de e-mails pendentes exibida (sem o corpo, carregado só na prévia)
+            query = f"""
+            SELECT id, remetente, destinatario, nome_destinatario, assunto, campanha_id, data_envio
+            FROM rastreamento_emails
+            WHERE status = 'Pendente'{filtros}
+            """
+            emails_pendentes = paginar_keyset(query, params, "aprovacao")
+            # Colunas explícitas: a página pode vir vazia se os pendentes foram aprovados em outra aba
+            df = pd.DataFrame(
+                emails_pendentes,
+                columns=["id", "remetente", "destinatario", "nome_destinatario", "assunto", "campanha_id", "data_envio"]
+            )
 
             # Adiciona uma coluna de seleção
             df["Selecionar"] = False
 
-            # Checkbox global para selecionar todas as linhas
-            selecionar_todos = st.checkbox("Selecionar Todos", key="selecionar_todos")
+            # Checkbox global: seleciona todos os pendentes do filtro, não só os da página
+            selecionar_todos = st.checkbox(
+                f"Selecionar Todos ({total_pendentes} e-mails no filtro)", key="selecionar_todos"
+            )
             if selecionar_todos:
                 df["Selecionar"] = True
 
@@ -525,41 +403,60 @@ def tela_aprovacao():
             selected_rows = st.data_editor(
                 df[["Selecionar", "id", "remetente", "destinatario", "nome_destinatario", "assunto", "data_envio"]],
                 use_container_width=True,
+                disabled=selecionar_todos,
                 key="aprovacao_table"
             )
 
-            # Exibe o corpo do e-mail apenas se um assistente for selecionado
-            if filtro_assistente != "Todos":
+            # Exibe o modelo do corpo sob demanda, um por campanha da página
+            if emails_pendentes and st.checkbox("Exibir prévia do corpo do e-mail", key="previa_aprovacao"):
+                campanhas_pagina = {}
+                for email in emails_pendentes:
+                    chave = ("campanha", email["campanha_id"]) if email["campanha_id"] is not None else ("email", email["id"])
+                    campanhas_pagina.setdefault(chave, email)
+                chave = st.selectbox(
+                    "Campanha",
+                    list(campanhas_pagina),
+                    format_func=lambda chave: f"{campanhas_pagina[chave]['assunto']} ({campanhas_pagina[chave]['remetente']})",
+                    key="campanha_previa_aprovacao"
+                )
                 st.markdown("**Modelo do Corpo do E-mail:**", unsafe_allow_html=True)
-                st.markdown(emails_pendentes[0]["corpo"], unsafe_allow_html=True)
+                if chave[0] == "campanha":
+                    st.markdown(obter_previa_campanha(chave[1]), unsafe_allow_html=True)
+                else:
+                    st.markdown(obter_previa_email(chave[1]), unsafe_allow_html=True)
+
+            # Ids marcados na página; com "Selecionar Todos" os botões agem direto no filtro, no banco
+            ids_marcados = selected_rows.loc[selected_rows["Selecionar"] == True, "id"].tolist()
 
             # Botões de aprovação ou rejeição
             if st.button("Aprovar Selecionados"):
-                emails_selecionados = df[df["Selecionar"] == True]
-                if not emails_selecionados.empty:
-                    # Atualiza o status para "Aprovado"
-                    atualizar_status_emails(emails_selecionados.to_dict("records"), "Aprovado")
-
-                    # Envia os e-mails aprovados
-                    for email in emails_selecionados.to_dict("records"):
-                        enviar_emails_smtp(
-                            subject=email["assunto"],
-                            body_html=email["corpo"],
-                            email_list=[{"Email": email["destinatario"], "Nome-RU": email["nome_destinatario"]}],
-                            email_user=st.session_state["usuario"],
-                            email_password=st.session_state["senha"]
-                        )
-
-                    st.success("E-mails aprovados e enviados com sucesso!")
+                if selecionar_todos or ids_marcados:
+                    # Coloca os e-mails aprovados na fila; os workers (fila_envio.py) fazem o envio
+                    # A sessão guarda só a chave do lote de aprovação, usada para acompanhar o andamento
+                    lote_aprovacao = uuid.uuid4().hex
+                    try:
+                        if selecionar_todos:
+                            enfileirados = enfileirar_pendentes(filtros, params, st.session_state["usuario"], lote_aprovacao)
+                        else:
+                            enfileirados = enfileirar_emails(ids_marcados, st.session_state["usuario"], lote_aprovacao)
+                        if enfileirados:
+                            st.session_state["lotes_na_fila"] = st.session_state.get("lotes_na_fila", []) + [lote_aprovacao]
+                        st.success(f"{enfileirados} e-mails aprovados e colocados na fila de envio!")
+                    except Exception as e:
+                        st.error(f"Erro ao enfileirar os e-mails aprovados: {e}")
                 else:
                     st.warning("Nenhum e-mail selecionado para aprovação.")
 
+            # O motivo precisa estar preenchido antes do clique para seguir no aviso
+            motivo = st.text_area("Motivo da Rejeição", key="motivo_rejeicao_aprovacao")
             if st.button("Rejeitar Selecionados"):
-                emails_selecionados = df[df["Selecionar"] == True]
-                if not emails_selecionados.empty:
-                    motivo = st.text_area("Motivo da Rejeição", key="motivo_rejeicao_aprovacao")
-                    atualizar_status_emails(emails_selecionados.to_dict("records"), "Rejeitado", motivo)
-                    st.warning("E-mails rejeitados e aviso enviado aos assistentes.")
+                if selecionar_todos or ids_marcados:
+                    if selecionar_todos:
+                        atualizados = atualizar_status_emails([], "Rejeitado", motivo, filtro=(filtros, params))
+                    else:
+                        atualizados = atualizar_status_emails([{"id": id_email} for id_email in ids_marcados], "Rejeitado", motivo)
+                    assistentes = len({remetente for _, remetente, _, _ in atualizados})
+                    st.warning(f"{len(atualizados)} e-mails rejeitados e aviso enviado a {assistentes} assistente(s).")
                 else:
                     st.warning("Nenhum e-mail selecionado para rejeição.")
         else:
@@ -567,96 +464,208 @@ def tela_aprovacao():
     except Exception as e:
         st.error(f"Erro ao carregar os e-mails pendentes: {e}")
 
-# Função para atualizar o status dos e-mails no banco de dados
-def atualizar_status_emails(emails, status, motivo=None):
+# Função para exibir o andamento dos lotes de aprovação enfileirados nesta sessão
+def exibir_progresso_fila():
+    lotes_na_fila = st.session_state.get("lotes_na_fila", [])
+    if not lotes_na_fila:
+        return
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cursor = conn.cursor()
+        progresso = progresso_fila(lotes_na_fila)
+    except Exception as e:
+        st.error(f"Erro ao consultar a fila de envio: {e}")
+        return
+
+    total = sum(progresso.values())
+    if not total:
+        return
+    enviados = progresso.get("Não Aberto", 0) + progresso.get("Aberto", 0)
+    falhas = progresso.get("Falha", 0)
+    st.subheader("Envio em Andamento")
+    st.progress((enviados + falhas) / total, text=f"{enviados} de {total} enviados, {falhas} com falha")
+
+    # Resultado por remetente e campanha
+    try:
+        grupos = progresso_fila_por_grupo(lotes_na_fila)
+        st.dataframe(pd.DataFrame(grupos), use_container_width=True)
+    except Exception as e:
+        st.error(f"Erro ao consultar o resultado por campanha: {e}")
+    if enviados + falhas >= total:
+        if st.button("Limpar Acompanhamento", key="limpar_fila"):
+            st.session_state["lotes_na_fila"] = []
+            st.rerun()
+    else:
+        st.button("Atualizar Andamento", key="atualizar_fila")
+
+# Função para exibir as métricas do pipeline de envio (painel e workers) e dos caches deste processo
+def exibir_metricas():
+    st.header("Métricas de Envio")
+    # Os workers da fila e da CLI publicam suas métricas no banco; aqui elas são somadas às do painel
+    try:
+        processos = metricas_workers()
+    except Exception as e:
+        st.error(f"Erro ao ler as métricas dos workers: {e}")
+        processos = []
+    st.caption(
+        f"Soma do painel e de {len(processos)} worker(s) ativo(s). "
+        "Cada processo também expõe as suas em /metrics."
+    )
+    try:
+        dados = instantaneo([processo["dados"] for processo in processos])
+    except Exception as e:
+        st.error(f"Erro ao coletar as métricas: {e}")
+        return
+
+    medidores = {(linha["metrica"], linha["rotulos"]): linha["valor"] for linha in dados["medidores"]}
+    contadores = {(linha["metrica"], linha["rotulos"]): linha["valor"] for linha in dados["contadores"]}
+    col_a, col_b, col_c, col_d = st.columns(4)
+    col_a.metric("E-mails/s (último minuto)", f"{medidores.get(('emails_por_segundo', ''), 0):.2f}")
+    col_b.metric("Aguardando na fila", medidores.get(("fila_profundidade", "status=Na Fila"), 0))
+    col_c.metric("Em envio", medidores.get(("fila_profundidade", "status=Enviando"), 0))
+    col_d.metric(
+        "Enviados / falhas",
+        f"{contadores.get(('emails_total', 'resultado=enviado'), 0)} / {contadores.get(('emails_total', 'resultado=falha'), 0)}"
+    )
 
-        for email in emails:
-            query = "UPDATE rastreamento_emails SET status = %s WHERE id = %s"
-            cursor.execute(query, (status, email["id"]))
+    st.subheader("Tempo por etapa")
+    if dados["etapas"]:
+        st.dataframe(pd.DataFrame(dados["etapas"]), use_container_width=True)
+    else:
+        st.info("Nenhum envio medido no painel ou nos workers ativos ainda.")
+
+    erros_smtp = [linha for linha in dados["contadores"] if linha["metrica"] == "smtp_erros_total"]
+    if erros_smtp:
+        st.subheader("Falhas por código SMTP")
+        st.dataframe(pd.DataFrame(erros_smtp)[["rotulos", "valor"]], use_container_width=True)
+
+    if processos:
+        with st.expander("Workers ativos"):
+            st.dataframe(
+                pd.DataFrame([{"processo": processo["processo"], "papel": processo["papel"]} for processo in processos]),
+                use_container_width=True
+            )
 
-            # Envia aviso ao assistente em caso de rejeição
-            if status == "Rejeitado" and motivo:
-                enviar_aviso_rejeicao(email["remetente"], motivo)
+    st.subheader("Caches e conexões do painel")
+    st.write("Pool do banco:", estatisticas_pool())
+    st.write("MinIO:", estado_minio())
+    st.write("Cache da equipe:", estatisticas_cache())
+    st.write("Cache de links assinados (por validade em segundos):", estatisticas_links())
+    st.button("Atualizar Métricas", key="atualizar_metricas")
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+# Função para atualizar o status dos e-mails no banco de dados
+# filtro=(filtros, params) aplica a mudança a todos os pendentes do filtro, sem listar os ids antes
+def atualizar_status_emails(emails, status, motivo=None, filtro=None):
+    try:
+        if filtro is not None:
+            condicao, params = filtro[0], tuple(filtro[1])
+        else:
+            ids = [int(email["id"]) for email in emails]
+            if not ids:
+                return []
+            condicao, params = " AND id = ANY(%s)", (ids,)
+
+        # Um único UPDATE para todas as linhas: os locks duram apenas o tempo do comando
+        # Só linhas ainda pendentes mudam: e-mails já enfileirados ou enviados por outra aba não são afetados
+        query = f"""
+        UPDATE rastreamento_emails
+        SET status = %s
+        WHERE status = 'Pendente'{condicao}
+        RETURNING id, remetente, destinatario, nome_destinatario
+        """
+        with conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (status, *params))
+            atualizados = cursor.fetchall()
+            conn.commit()
+            cursor.close()
     except Exception as e:
         st.error(f"Erro ao atualizar o status dos e-mails: {e}")
+        return []
+
+    # Envia um único aviso por assistente em caso de rejeição, já fora da transação
+    if status == "Rejeitado" and motivo:
+        rejeitados_por_assistente = {}
+        for _, remetente, destinatario, nome_destinatario in atualizados:
+            rejeitados_por_assistente.setdefault(remetente, []).append((destinatario, nome_destinatario))
+        for remetente, destinatarios in rejeitados_por_assistente.items():
+            enviar_aviso_rejeicao(remetente, motivo, destinatarios)
 
-# Função para enviar aviso de rejeição ao assistente
-def enviar_aviso_rejeicao(email_assistente, motivo):
+    return atualizados
+
+# Função para enviar aviso de rejeição ao assistente, listando os destinatários afetados
+def enviar_aviso_rejeicao(email_assistente, motivo, destinatarios=()):
     try:
-        smtp_server = "smtp.office365.com"
-        smtp_port = 587
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(st.session_state["usuario"], st.session_state["senha"])
+        sessao = obter_sessao_smtp(st.session_state["usuario"], st.session_state["senha"])
 
         subject = "Envio de E-mails Não Autorizado"
         body = f"Seu envio de e-mails foi rejeitado. Motivo: {motivo}"
+        if destinatarios:
+            body += f"\n\nE-mails rejeitados ({len(destinatarios)}):\n"
+            body += "\n".join(f"- {nome} <{email}>" if nome else f"- {email}" for email, nome in destinatarios)
         msg = MIMEMultipart()
         msg["From"] = st.session_state["usuario"]
         msg["To"] = email_assistente
         msg["Subject"] = subject
         msg.attach(MIMEText(body, "plain"))
 
-        server.sendmail(st.session_state["usuario"], email_assistente, msg.as_string())
-        server.quit()
+        sessao.enviar(st.session_state["usuario"], email_assistente, msg.as_string())
     except Exception as e:
         st.error(f"Erro ao enviar aviso de rejeição: {e}")
 
-# Função para obter o perfil do usuário logado
-def obter_perfil_usuario(email):
-    try:
-        # Conexão com o banco de dados
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
+# Consultas à equipe em cache: mudam poucas vezes por semana e são feitas a cada interação
+@cache_equipe
+def _buscar_perfil_usuario(email):
+    with conexao() as conn:
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         # Consulta para obter o perfil do usuário
         query = 'SELECT "Perfil" FROM "Equipe_Completa" WHERE "EMAIL" = %s'
         cursor.execute(query, (email,))
         result = cursor.fetchone()
         cursor.close()
-        conn.close()
-        return result["Perfil"] if result else None
-    except Exception as e:
-        st.error(f"Erro ao obter o perfil do usuário: {e}")
-        return None
+    return result["Perfil"] if result else None
 
-# Função para obter o nome do remetente a partir do e-mail
-def obter_nome_remetente(email):
-    try:
-        # Conexão com o banco de dados
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
+@cache_equipe
+def _buscar_nome_colaborador(email):
+    with conexao() as conn:
         cursor = conn.cursor()
         # Consulta para obter o nome do colaborador
         query = 'SELECT "Nome_Colaborador" FROM "Equipe_Completa" WHERE "EMAIL" = %s'
         cursor.execute(query, (email,))
         result = cursor.fetchone()
         cursor.close()
-        conn.close()
-        return result[0] if result else "Equipe UNINTER"
+    return result[0] if result else None
+
+@cache_equipe
+def _buscar_emails_colaborador(nome):
+    with conexao() as conn:
+        cursor = conn.cursor()
+        query = 'SELECT "EMAIL" FROM "Equipe_Completa" WHERE "Nome_Colaborador" = %s'
+        cursor.execute(query, (nome,))
+        emails = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    return emails
+
+@cache_equipe
+def _buscar_nomes_por_perfil(perfil):
+    with conexao() as conn:
+        cursor = conn.cursor()
+        query = 'SELECT DISTINCT "Nome_Colaborador" FROM "Equipe_Completa" WHERE "Perfil" = %s'
+        cursor.execute(query, (perfil,))
+        nomes = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    return nomes
+
+# Função para obter o perfil do usuário logado
+def obter_perfil_usuario(email):
+    try:
+        return _buscar_perfil_usuario(email)
+    except Exception as e:
+        st.error(f"Erro ao obter o perfil do usuário: {e}")
+        return None
+
+# Função para obter o nome do remetente a partir do e-mail
+def obter_nome_remetente(email):
+    try:
+        return _buscar_nome_colaborador(email) or "Equipe UNINTER"
     except Exception as e:
         st.error(f"Erro ao obter o nome do remetente: {e}")
         return "Equipe UNINTER"
@@ -664,20 +673,7 @@ def obter_nome_remetente(email):
 # Função para obter a lista de avançados (nomes)
 def obter_lista_avancados():
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cursor = conn.cursor()
-        query = 'SELECT DISTINCT "Nome_Colaborador" FROM "Equipe_Completa" WHERE "Perfil" = %s'
-        cursor.execute(query, ("avançado",))
-        avancados = [row[0] for row in cursor.fetchall()]
-        cursor.close()
-        conn.close()
-        return avancados
+        return list(_buscar_nomes_por_perfil("avançado"))
     except Exception as e:
         st.error(f"Erro ao obter a lista de avançados: {e}")
         return []
@@ -685,20 +681,7 @@ def obter_lista_avancados():
 # Função para obter a lista de assistentes (nomes)
 def obter_lista_assistentes():
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cursor = conn.cursor()
-        query = 'SELECT DISTINCT "Nome_Colaborador" FROM "Equipe_Completa" WHERE "Perfil" = %s'
-        cursor.execute(query, ("assistente",))
-        assistentes = [row[0] for row in cursor.fetchall()]
-        cursor.close()
-        conn.close()
-        return assistentes
+        return list(_buscar_nomes_por_perfil("assistente"))
     except Exception as e:
         st.error(f"Erro ao obter a lista de assistentes: {e}")
         return []
@@ -748,7 +731,7 @@ def tela_principal():
         if perfil_usuario == "assistente":
             abas = ["Envio em Massa", "Alterar Senha"]
         else:
-            abas = ["Envio em Massa", "Alterar Senha", "Rastreamento", "Aprovação"]
+            abas = ["Envio em Massa", "Alterar Senha", "Rastreamento", "Aprovação", "Métricas"]
 
         # Aba para selecionar o tipo de envio
         tab1, tab2, *rest = st.tabs(abas)
@@ -773,7 +756,7 @@ def tela_principal():
                 <body>
                     <div style="background-color:{border_color};border:1px solid Tomato;text-align: center">
                         <p><img src="https://portal.uninter.com/wp-content/themes/portal/imagens/marca-uninter-horizontal.png" alt="Logo UNINTER"></p>
-                        <h1 style="color:{text_color};">Olá Nome-RU ,</h1>
+                        <h1 style="color:{text_color};">Olá {{{{ Nome-RU }}}} ,</h1>
                     </div>
                     <div style="background-color:white;font-size: 28px;border: 5px solid black;margin: 0 auto;padding: 10px;">
                         <h2 style="color:{text_color};">{subject}</h2>
@@ -782,16 +765,12 @@ def tela_principal():
                         <p style="color:{text_color};">{remetente_nome}</p>
                         <p><img src="https://res.cloudinary.com/dilr8ucsa/image/upload/v1744312588/image001_mu3fan.jpg" alt="Logo UNINTER" style="width: auto; height: auto;"></p>
                         <!-- Marcador de rastreamento -->
-                        <img src="rastreamento_url" alt="" style="display:none;width:1px;height:1px;">
+                        <img src="{{{{ rastreamento_url }}}}" alt="" style="display:none;width:1px;height:1px;">
                     </div>
                 </body>
             </div>
             """
 
-            # Prévia do HTML
-            st.subheader("Prévia do HTML")
-            st.markdown(body_html.replace("{{ rastreamento_url }}", "URL_DE_EXEMPLO"), unsafe_allow_html=True)
-
             # Tabela editável para entrada de dados
             st.write("Insira os dados dos destinatários (Nome-RU e Email):")
             data = [
@@ -799,17 +778,34 @@ def tela_principal():
             ]
             editable_table = st.data_editor(data, num_rows="dynamic", key="mass_table")
 
+            # Compila o modelo e valida os campos contra as colunas da tabela de destinatários
+            colunas = list(editable_table[0].keys()) if editable_table else list(data[0].keys())
+            try:
+                modelo = compilar_modelo(body_html, colunas + [CAMPO_RASTREAMENTO])
+            except ValueError as e:
+                modelo = None
+                st.error(f"Modelo inválido: {e}")
+
+            # Prévia do HTML
+            st.subheader("Prévia do HTML")
+            if modelo:
+                st.markdown(modelo.renderizar({CAMPO_RASTREAMENTO: "URL_DE_EXEMPLO"}, parcial=True), unsafe_allow_html=True)
+
             if st.button("Salvar para Aprovação", key="save_button"):
-                if subject and body_text and editable_table:
+                if modelo is None:
+                    st.error("Corrija os campos do modelo antes de salvar.")
+                elif subject and body_text and editable_table:
                     email_list = [row for row in editable_table if row["Nome-RU"] and row["Email"]]
                     if email_list:
-                        salvar_emails_pendentes(
+                        resultado = salvar_emails_pendentes(
                             st.session_state["usuario"],
                             email_list,
                             subject,
                             body_html
                         )
-                        st.success("E-mails salvos para aprovação!")
+                        if resultado:
+                            linhas, taxa = resultado
+                            st.success(f"{linhas} e-mails salvos para aprovação! ({taxa:.0f} linhas/s)")
                     else:
                         st.error("Por favor, preencha todos os campos da tabela.")
                 else:
@@ -840,6 +836,11 @@ def tela_principal():
             with rest[1]:
                 tela_aprovacao()
 
+        # Aba 5: Métricas do envio (somente para não-assistentes)
+        if perfil_usuario != "assistente" and len(rest) > 2:
+            with rest[2]:
+                exibir_metricas()
+
 # Controle de login
 if st.session_state["logado"]:
     tela_principal()
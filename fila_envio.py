@@ -0,0 +1,402 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from dotenv import load_dotenv
+from psycopg2.extras import Json, RealDictCursor, execute_values
+from pytz import timezone
+
+from armazenamento import gerar_link_rastreamento
+from banco import conexao
+from despacho_smtp import SMTP_LIMITE_DIA, SMTP_LIMITE_MINUTO
+from campanhas import renderizar_corpo
+from limitador_taxa import PostgresBucketStore, RateLimiter
+from migracoes import verificar_esquema
+from metricas_envio import exportar, iniciar_servidor_metricas, medir, registrar_medidor, registrar_resultado_envio
+from modelo_email import CAMPO_RASTREAMENTO
+from smtp_sessoes import obter_sessao_smtp
+
+load_dotenv(".env")
+
+# Conta usada pelos workers para enviar (os workers não têm acesso à senha de quem aprovou)
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+
+# Configuração da fila
+FILA_TAMANHO_LOTE = int(os.getenv("FILA_TAMANHO_LOTE", "20"))  # Linhas reivindicadas por vez
+FILA_INTERVALO = float(os.getenv("FILA_INTERVALO", "2"))  # Espera quando a fila está vazia
+FILA_MAX_TENTATIVAS = int(os.getenv("FILA_MAX_TENTATIVAS", "3"))
+FILA_TRAVADO_MINUTOS = int(os.getenv("FILA_TRAVADO_MINUTOS", "15"))  # Reivindicações mais antigas voltam para a fila
+
+# Publicação das métricas dos workers no banco, somadas na aba de métricas do painel
+METRICAS_PUBLICACAO_SEGUNDOS = float(os.getenv("METRICAS_PUBLICACAO_SEGUNDOS", "15"))
+METRICAS_VALIDADE_SEGUNDOS = float(os.getenv("METRICAS_VALIDADE_SEGUNDOS", "120"))  # Processos sem publicar há mais tempo saem da soma
+
+# Estados da fila em rastreamento_emails.status
+# 'Aprovado' não é usado pela fila: nas linhas antigas ele marca pendentes já enviados pelo painel
+STATUS_NA_FILA = "Na Fila"
+STATUS_ENVIANDO = "Enviando"
+STATUS_ENVIADO = "Não Aberto"
+STATUS_FALHA = "Falha"
+
+fuso_horario_brasil = timezone("America/Sao_Paulo")
+
+# Função para falhar logo, com uma mensagem clara, quando a conta de envio dos workers não está configurada
+def verificar_credenciais_smtp():
+    faltando = [nome for nome, valor in (("SMTP_USER", SMTP_USER), ("SMTP_PASSWORD", SMTP_PASSWORD)) if not valor]
+    if faltando:
+        raise RuntimeError(f"Conta de envio não configurada: defina {' e '.join(faltando)} no ambiente ou no .env")
+
+# Colunas gravadas ao enfileirar; lote_aprovacao identifica o clique de aprovação para acompanhar o andamento
+_SET_ENFILEIRAR = "status = %s, aprovado_por = %s, lote_aprovacao = %s, tentativas = 0, erro_envio = NULL"
+
+# Função para colocar e-mails na fila de envio; retorna a quantidade enfileirada
+def enfileirar_emails(ids, aprovado_por=None, lote_aprovacao=None):
+    ids = [int(id_email) for id_email in ids]
+    if not ids:
+        return 0
+    query = f"""
+    UPDATE rastreamento_emails
+    SET {_SET_ENFILEIRAR}
+    WHERE id = ANY(%s) AND status IN ('Pendente', 'Na Fila', 'Falha')
+    """
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (STATUS_NA_FILA, aprovado_por, lote_aprovacao, ids))
+        enfileirados = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return enfileirados
+
+# Função para colocar na fila todos os pendentes de um filtro num único UPDATE, sem trazer os ids ao Python
+# filtros é um trecho "AND ..." com os parâmetros em params (ver montar_filtros_rastreamento no painel)
+def enfileirar_pendentes(filtros, params, aprovado_por=None, lote_aprovacao=None):
+    query = f"""
+    UPDATE rastreamento_emails
+    SET {_SET_ENFILEIRAR}
+    WHERE status = 'Pendente'{filtros}
+    """
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (STATUS_NA_FILA, aprovado_por, lote_aprovacao, *params))
+        enfileirados = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return enfileirados
+
+# Função para reivindicar um lote da fila; SKIP LOCKED permite vários workers em paralelo
+# Com campanha_id, só reivindica e-mails dessa campanha
+def reivindicar_lote(worker_id, tamanho=FILA_TAMANHO_LOTE, campanha_id=None):
+    filtro_campanha = "AND campanha_id = %s" if campanha_id is not None else ""
+    query = f"""
+    WITH lote AS (
+        SELECT id
+        FROM rastreamento_emails
+        WHERE status = %s {filtro_campanha}
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE rastreamento_emails r
+    SET status = %s, reivindicado_por = %s, reivindicado_em = now(), tentativas = r.tentativas + 1
+    FROM lote
+    WHERE r.id = lote.id
+    RETURNING r.id, r.remetente, r.destinatario, r.nome_destinatario, r.assunto, r.corpo,
+              r.campanha_id, r.valores, r.id_rastreamento, r.tentativas
+    """
+    with conexao() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        parametros = [STATUS_NA_FILA] + ([campanha_id] if campanha_id is not None else [])
+        cursor.execute(query, parametros + [tamanho, STATUS_ENVIANDO, worker_id])
+        lote = cursor.fetchall()
+        conn.commit()
+        cursor.close()
+    return lote
+
+# Função para devolver à fila as reivindicações de workers que morreram no meio do envio
+def recuperar_travados(minutos=FILA_TRAVADO_MINUTOS):
+    query = """
+    UPDATE rastreamento_emails
+    SET status = CASE WHEN tentativas >= %s THEN %s ELSE %s END
+    WHERE status = %s AND reivindicado_em < now() - make_interval(mins => %s)
+    """
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (FILA_MAX_TENTATIVAS, STATUS_FALHA, STATUS_NA_FILA, STATUS_ENVIANDO, minutos))
+        recuperados = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return recuperados
+
+# Função para repetir a recuperação no máximo uma vez a cada FILA_TRAVADO_MINUTOS
+# Retorna o instante (time.monotonic) da última recuperação
+def recuperar_travados_periodicamente(worker_id, ultima_recuperacao):
+    if time.monotonic() - ultima_recuperacao < FILA_TRAVADO_MINUTOS * 60:
+        return ultima_recuperacao
+    recuperados = recuperar_travados()
+    if recuperados:
+        print(f"[{worker_id}] {recuperados} e-mails travados devolvidos à fila")
+    return time.monotonic()
+
+# Função para gravar de uma vez o resultado dos envios de um lote: [(id, tentativas, erro ou None)]
+def concluir_lote(resultados):
+    if not resultados:
+        return
+    agora = datetime.now(fuso_horario_brasil)
+    linhas = []
+    for id_email, tentativas, erro in resultados:
+        if erro is None:
+            linhas.append((id_email, STATUS_ENVIADO, agora, None))
+        else:
+            # Volta para a fila até esgotar as tentativas
+            status = STATUS_FALHA if tentativas >= FILA_MAX_TENTATIVAS else STATUS_NA_FILA
+            linhas.append((id_email, status, None, str(erro)[:1000]))
+    query = """
+    UPDATE rastreamento_emails r
+    SET status = CASE
+            -- O pixel pode ter sido aberto antes do fim do lote: não volta para 'Não Aberto'
+            WHEN r.status = 'Aberto' THEN r.status
+            ELSE v.status
+        END,
+        data_envio = COALESCE(v.data_envio, r.data_envio),
+        erro_envio = v.erro_envio
+    FROM (VALUES %s) AS v (id, status, data_envio, erro_envio)
+    WHERE r.id = v.id
+    """
+    with medir("registro_envio_segundos", modo="lote"), conexao() as conn:
+        cursor = conn.cursor()
+        execute_values(cursor, query, linhas, template="(%s, %s, %s::timestamptz, %s)")
+        conn.commit()
+        cursor.close()
+
+# Função para consultar o andamento dos e-mails enfileirados nos lotes de aprovação informados
+def progresso_fila(lotes):
+    if not lotes:
+        return {}
+    query = "SELECT status, COUNT(*) FROM rastreamento_emails WHERE lote_aprovacao = ANY(%s) GROUP BY status"
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (list(lotes),))
+        progresso = dict(cursor.fetchall())
+        cursor.close()
+    return progresso
+
+# Função para consultar o andamento dos e-mails enfileirados por remetente e campanha
+def progresso_fila_por_grupo(lotes):
+    if not lotes:
+        return []
+    query = """
+    SELECT remetente, campanha_id, assunto,
+        COUNT(*) AS total,
+        COUNT(*) FILTER (WHERE status IN ('Não Aberto', 'Aberto')) AS enviados,
+        COUNT(*) FILTER (WHERE status = 'Falha') AS falhas,
+        MAX(erro_envio) FILTER (WHERE status = 'Falha') AS ultimo_erro
+    FROM rastreamento_emails
+    WHERE lote_aprovacao = ANY(%s)
+    GROUP BY remetente, campanha_id, assunto
+    ORDER BY remetente, campanha_id
+    """
+    with conexao() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(query, (list(lotes),))
+        grupos = cursor.fetchall()
+        cursor.close()
+    return grupos
+
+# Função para contar os e-mails aguardando envio e em envio (lida a cada coleta de métricas)
+def profundidade_fila():
+    query = """
+    SELECT status, COUNT(*)
+    FROM rastreamento_emails
+    WHERE status IN (%s, %s)
+    GROUP BY status
+    """
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (STATUS_NA_FILA, STATUS_ENVIANDO))
+        contagens = dict(cursor.fetchall())
+        cursor.close()
+    return [({"status": status}, contagens.get(status, 0)) for status in (STATUS_NA_FILA, STATUS_ENVIANDO)]
+
+registrar_medidor("fila_profundidade", profundidade_fila)
+
+# Função para gravar as métricas acumuladas deste processo (uma linha por processo)
+# Linhas de processos parados há mais de um dia são apagadas na mesma transação
+def publicar_metricas(processo, papel):
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+        INSERT INTO metricas_processos (processo, papel, dados, atualizado_em)
+        VALUES (%s, %s, %s, now())
+        ON CONFLICT (processo) DO UPDATE
+        SET dados = EXCLUDED.dados, atualizado_em = EXCLUDED.atualizado_em
+        """, (processo, papel, Json(exportar())))
+        cursor.execute("DELETE FROM metricas_processos WHERE atualizado_em < now() - interval '1 day'")
+        conn.commit()
+        cursor.close()
+
+# Função para publicar as métricas em segundo plano a cada METRICAS_PUBLICACAO_SEGUNDOS
+def iniciar_publicacao_metricas(processo, papel):
+    def publicar_periodicamente():
+        while True:
+            time.sleep(METRICAS_PUBLICACAO_SEGUNDOS)
+            try:
+                publicar_metricas(processo, papel)
+            except Exception as e:
+                print(f"[{processo}] Erro ao publicar as métricas: {e}")
+    threading.Thread(target=publicar_periodicamente, daemon=True).start()
+
+# Função para ler as métricas publicadas recentemente pelos workers: [{processo, papel, dados}]
+def metricas_workers(validade=METRICAS_VALIDADE_SEGUNDOS):
+    query = """
+    SELECT processo, papel, dados
+    FROM metricas_processos
+    WHERE atualizado_em > now() - make_interval(secs => %s)
+    ORDER BY papel, processo
+    """
+    with conexao() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(query, (validade,))
+        processos = cursor.fetchall()
+        cursor.close()
+    return processos
+
+# Função para montar e enviar um e-mail reivindicado da fila
+def enviar_email_da_fila(sessao, email):
+    msg = MIMEMultipart("alternative")
+    msg["From"] = sessao.usuario
+    msg["To"] = email["destinatario"]
+    msg["Subject"] = email["assunto"]
+    # A conta dos workers só envia: as respostas voltam para o assistente que criou o e-mail
+    if email["remetente"]:
+        msg["Reply-To"] = email["remetente"]
+
+    # Gera o link da imagem de rastreamento com o ID já gravado na linha
+    link_rastreamento = gerar_link_rastreamento(email["id_rastreamento"])
+    if link_rastreamento is None:
+        raise RuntimeError("Não foi possível hospedar a imagem de rastreamento")
+
+    # Renderiza o modelo da campanha com os valores do destinatário e o link de rastreamento
+    with medir("montagem_mime_segundos"):
+        body_personalizado = renderizar_corpo(email, {CAMPO_RASTREAMENTO: link_rastreamento})
+        msg.attach(MIMEText(body_personalizado, "html"))
+        mensagem = msg.as_string()
+
+    sessao.enviar(sessao.usuario, email["destinatario"], mensagem)
+
+# Função para enviar um lote reivindicado agrupado por remetente e campanha
+# Cada grupo usa a mesma sessão autenticada; os resultados são gravados de uma vez ao final
+# Retorna o relatório por grupo: [{remetente, campanha_id, enviados, reenfileirados, falhas}]
+# falhas conta só as que esgotaram as tentativas; as demais voltam para a fila (reenfileirados)
+def processar_lote(sessao, lote, limitador=None):
+    grupos = {}
+    for email in lote:
+        grupos.setdefault((email["remetente"], email["campanha_id"]), []).append(email)
+
+    resultados = []
+    relatorio = []
+    for (remetente, campanha_id), emails in grupos.items():
+        enviados = reenfileirados = 0
+        for email in emails:
+            try:
+                if limitador is not None:
+                    limitador.wait_for_next_email(sessao.usuario)
+                enviar_email_da_fila(sessao, email)
+                resultados.append((email["id"], email["tentativas"], None))
+                registrar_resultado_envio()
+                enviados += 1
+            except Exception as e:
+                print(f"Erro ao enviar para {email['destinatario']}: {e}")
+                resultados.append((email["id"], email["tentativas"], e))
+                registrar_resultado_envio(e)
+                if email["tentativas"] < FILA_MAX_TENTATIVAS:
+                    reenfileirados += 1
+        relatorio.append({
+            "remetente": remetente,
+            "campanha_id": campanha_id,
+            "enviados": enviados,
+            "reenfileirados": reenfileirados,
+            "falhas": len(emails) - enviados - reenfileirados,
+        })
+
+    concluir_lote(resultados)
+    return relatorio
+
+# Loop de um processo worker: reivindica lotes, envia e registra o resultado
+def executar_worker(worker_id, uma_vez=False):
+    verificar_credenciais_smtp()
+    sessao = obter_sessao_smtp(SMTP_USER, SMTP_PASSWORD)
+    # Buckets no PostgreSQL: todos os workers, em todos os nós, dividem a cota da conta
+    limitador = RateLimiter(
+        max_emails_per_day=SMTP_LIMITE_DIA,
+        max_emails_per_minute=SMTP_LIMITE_MINUTO,
+        store=PostgresBucketStore(conexao)
+    )
+    print(f"[{worker_id}] Worker iniciado")
+    # A recuperação inicial é feita na partida; depois, só quando a fila esvazia
+    ultima_recuperacao = time.monotonic()
+    while True:
+        lote = reivindicar_lote(worker_id)
+        if not lote:
+            if uma_vez:
+                break
+            ultima_recuperacao = recuperar_travados_periodicamente(worker_id, ultima_recuperacao)
+            time.sleep(FILA_INTERVALO)
+            continue
+
+        inicio = time.perf_counter()
+        relatorio = processar_lote(sessao, lote, limitador)
+        duracao = time.perf_counter() - inicio
+        for grupo in relatorio:
+            print(
+                f"[{worker_id}] Campanha {grupo['campanha_id']} de {grupo['remetente']}: "
+                f"{grupo['enviados']} enviados, {grupo['reenfileirados']} de volta à fila, {grupo['falhas']} falhas"
+            )
+        print(f"[{worker_id}] {len(lote)} e-mails processados em {duracao:.1f}s")
+
+def _processo_worker(indice, uma_vez):
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{indice}"
+    # Cada processo expõe suas métricas numa porta própria (porta base da fila + índice) e as publica no banco
+    iniciar_servidor_metricas("fila", indice)
+    iniciar_publicacao_metricas(worker_id, "fila")
+    executar_worker(worker_id, uma_vez)
+    try:
+        publicar_metricas(worker_id, "fila")
+    except Exception as e:
+        print(f"[{worker_id}] Erro ao publicar as métricas: {e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Workers da fila de envio de e-mails")
+    parser.add_argument("--processos", type=int, default=1, help="Quantidade de processos worker neste nó")
+    parser.add_argument("--uma-vez", action="store_true", help="Encerra quando a fila estiver vazia")
+    args = parser.parse_args()
+
+    try:
+        verificar_credenciais_smtp()
+    except RuntimeError as e:
+        sys.exit(str(e))
+    verificar_esquema()
+    recuperados = recuperar_travados()
+    if recuperados:
+        print(f"{recuperados} e-mails travados devolvidos à fila")
+
+    if args.processos == 1:
+        _processo_worker(0, args.uma_vez)
+    else:
+        # spawn: cada processo cria seu próprio pool de conexões e sessões SMTP
+        contexto = multiprocessing.get_context("spawn")
+        processos = [
+            contexto.Process(target=_processo_worker, args=(indice, args.uma_vez))
+            for indice in range(args.processos)
+        ]
+        for processo in processos:
+            processo.start()
+        for processo in processos:
+            processo.join()
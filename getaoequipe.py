@@ -6,6 +6,7 @@ import os
 from PIL import Image
 import requests
 from io import BytesIO
+from cache_equipe import invalidar_equipe
 
 # Load environment variables
 load_dotenv()
@@ -178,6 +179,7 @@ def add_member(nome, matricula, cargo, reporte, equipe, situacao, email, anivers
     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
     """
     cur.execute(query, (matricula, nome, cargo, reporte, equipe, situacao, email, aniversario, data_retorno, foto_url))
+    invalidar_equipe(cur)  # Avisa o painel de envio para descartar o cache da equipe
     conn.commit()
     cur.close()
     conn.close()
@@ -194,6 +196,7 @@ def update_member(id, nome, matricula, cargo, reporte, equipe, situacao, email,
     WHERE "id" = %s
     """
     cur.execute(query, (matricula, nome, cargo, reporte, equipe, situacao, email, aniversario, data_retorno, foto_url, id))
+    invalidar_equipe(cur)  # Avisa o painel de envio para descartar o cache da equipe
     conn.commit()
     cur.close()
     conn.close()
@@ -204,6 +207,7 @@ def delete_member(id):
     cur = conn.cursor()
     query = 'DELETE FROM "Equipe_Completa" WHERE "id" = %s'
     cur.execute(query, (id,))
+    invalidar_equipe(cur)  # Avisa o painel de envio para descartar o cache da equipe
     conn.commit()
     cur.close()
     conn.close()
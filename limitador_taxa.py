@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+# Arquivo SQLite compartilhado pelos processos desta máquina (use PostgresBucketStore entre máquinas)
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(os.path.expanduser("~"), ".rate_limiter.sqlite3"))
+
+
+# Estado dos buckets em SQLite; a transação IMMEDIATE serializa os processos que disputam a mesma conta
+class SQLiteBucketStore:
+    def __init__(self, path=RATE_LIMIT_DB):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                account TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (account, bucket)
+            )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def update(self, account, buckets, func):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                state = {}
+                for name in buckets:
+                    row = conn.execute(
+                        "SELECT tokens, updated_at FROM rate_limit_buckets WHERE account = ? AND bucket = ?",
+                        (account, name)
+                    ).fetchone()
+                    state[name] = row
+                new_state, result = func(state)
+                for name, (tokens, updated_at) in new_state.items():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO rate_limit_buckets (account, bucket, tokens, updated_at) VALUES (?, ?, ?, ?)",
+                        (account, name, tokens, updated_at)
+                    )
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+
+# Estado dos buckets em PostgreSQL; connection_factory deve retornar um gerenciador de contexto com a conexão
+class PostgresBucketStore:
+    def __init__(self, connection_factory):
+        self.connection_factory = connection_factory
+        with self.connection_factory() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                account TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                tokens DOUBLE PRECISION NOT NULL,
+                updated_at DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (account, bucket)
+            )
+            """)
+            conn.commit()
+            cursor.close()
+
+    def update(self, account, buckets, func):
+        with self.connection_factory() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT bucket, tokens, updated_at FROM rate_limit_buckets WHERE account = %s AND bucket = ANY(%s) FOR UPDATE",
+                (account, list(buckets))
+            )
+            found = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+            state = {name: found.get(name) for name in buckets}
+            new_state, result = func(state)
+            for name, (tokens, updated_at) in new_state.items():
+                cursor.execute("""
+                INSERT INTO rate_limit_buckets (account, bucket, tokens, updated_at)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (account, bucket) DO UPDATE
+                SET tokens = EXCLUDED.tokens, updated_at = EXCLUDED.updated_at
+                """, (account, name, tokens, updated_at))
+            conn.commit()
+            cursor.close()
+            return result
+
+
+# Token bucket por conta remetente, com um bucket por minuto e outro por dia
+class RateLimiter:
+    def __init__(self, max_emails_per_day=500, max_emails_per_minute=10, store=None):
+        self.max_emails_per_day = max_emails_per_day
+        self.max_emails_per_minute = max_emails_per_minute
+        self.store = store or SQLiteBucketStore()
+        # nome: (capacidade, tokens repostos por segundo)
+        self.buckets = {
+            "minute": (max_emails_per_minute, max_emails_per_minute / 60.0),
+            "day": (max_emails_per_day, max_emails_per_day / 86400.0),
+        }
+
+    def _refill(self, state, now):
+        refilled = {}
+        for name, (capacity, rate) in self.buckets.items():
+            if state.get(name) is None:
+                refilled[name] = (float(capacity), now)
+            else:
+                tokens, updated_at = state[name]
+                tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+                refilled[name] = (tokens, now)
+        return refilled
+
+    # Tenta consumir um envio da conta; retorna 0 se liberado ou os segundos a aguardar (sem bloquear)
+    def acquire(self, account, tokens=1):
+        def consume(state):
+            now = time.time()
+            refilled = self._refill(state, now)
+            wait = 0.0
+            for name, (capacity, rate) in self.buckets.items():
+                available = refilled[name][0]
+                if available < tokens:
+                    wait = max(wait, (tokens - available) / rate)
+            if wait == 0.0:
+                refilled = {name: (available - tokens, now) for name, (available, _) in refilled.items()}
+            return refilled, wait
+
+        return self.store.update(account.lower(), list(self.buckets), consume)
+
+    # Versão bloqueante de acquire, para chamadores síncronos
+    def wait_for_next_email(self, account):
+        while True:
+            wait = self.acquire(account)
+            if wait == 0:
+                return
+            time.sleep(wait)
@@ -0,0 +1,169 @@
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from minio.deleteobjects import DeleteObject
+
+from armazenamento import obter_minio, BUCKET_RASTREAMENTO
+from banco import conexao
+from servidor_pixel import garantir_indice_rastreamento
+
+# Configuração da limpeza das imagens de rastreamento antigas
+LIMPEZA_RETENCAO_DIAS = int(os.getenv("LIMPEZA_RETENCAO_DIAS", "90"))  # Pixels mais antigos que isso são apagados
+LIMPEZA_CARENCIA_HORAS = int(os.getenv("LIMPEZA_CARENCIA_HORAS", "24"))  # Imagens sem linha no banco só depois disso
+LIMPEZA_TAMANHO_LOTE = 1000  # Máximo de chaves aceitas por chamada de remoção múltipla
+LIMPEZA_PARALELO = int(os.getenv("LIMPEZA_PARALELO", "4"))
+LIMPEZA_CHECKPOINT = os.getenv("LIMPEZA_CHECKPOINT", ".limpeza_rastreamento.checkpoint")
+
+
+# Função para ler a última chave já processada (a listagem do bucket é em ordem alfabética)
+def ler_checkpoint(caminho=LIMPEZA_CHECKPOINT):
+    try:
+        with open(caminho) as arquivo:
+            return arquivo.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def gravar_checkpoint(chave, caminho=LIMPEZA_CHECKPOINT):
+    temporario = caminho + ".tmp"
+    with open(temporario, "w") as arquivo:
+        arquivo.write(chave)
+    os.replace(temporario, caminho)
+
+# Função para buscar no banco a data de envio de cada id de rastreamento do lote
+def datas_envio(ids):
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT id_rastreamento::text, COALESCE(data_envio, data_abertura)
+        FROM rastreamento_emails
+        WHERE id_rastreamento::text = ANY(%s)
+        """, (ids,))
+        resultado = dict(cursor.fetchall())
+        cursor.close()
+    return resultado
+
+# Função para escolher, de um lote de objetos listados, quais podem ser apagados
+# Com linha no banco: apaga se o envio passou da retenção
+# Sem linha no banco: apaga se a imagem passou da carência (o envio pode ter sido registrado depois do upload)
+def selecionar_expirados(objetos, limite_retencao, limite_carencia):
+    ids = {obj.object_name: obj.object_name.rsplit(".", 1)[0] for obj in objetos}
+    enviados = datas_envio(list(ids.values()))
+    expirados = []
+    for obj in objetos:
+        data_envio = enviados.get(ids[obj.object_name])
+        if data_envio is not None:
+            referencia = data_envio if data_envio.tzinfo else data_envio.replace(tzinfo=timezone.utc)
+            if referencia < limite_retencao:
+                expirados.append(obj.object_name)
+        elif obj.last_modified < limite_carencia:
+            expirados.append(obj.object_name)
+    return expirados
+
+# Função para apagar um lote de objetos com uma única requisição; retorna quantos falharam
+def remover_lote(nomes):
+    falhas = 0
+    # remove_objects é preguiçoso: os erros só existem ao percorrer o retorno
+    for erro in obter_minio().remove_objects(BUCKET_RASTREAMENTO, [DeleteObject(nome) for nome in nomes]):
+        falhas += 1
+        print(f"Erro ao apagar {erro.name}: {erro.message}")
+    return falhas
+
+# Percorre o bucket de rastreamento em lotes, apagando em paralelo as imagens expiradas
+# Interrompida, recomeça da última chave cujo lote (e todos os anteriores) foi concluído
+def limpar_rastreamento(retencao_dias=LIMPEZA_RETENCAO_DIAS, carencia_horas=LIMPEZA_CARENCIA_HORAS,
+                        paralelo=LIMPEZA_PARALELO, max_por_segundo=0, simular=False,
+                        caminho_checkpoint=LIMPEZA_CHECKPOINT):
+    agora = datetime.now(timezone.utc)
+    limite_retencao = agora - timedelta(days=retencao_dias)
+    limite_carencia = agora - timedelta(hours=carencia_horas)
+    inicio_chave = ler_checkpoint(caminho_checkpoint)
+    if inicio_chave:
+        print(f"Retomando após {inicio_chave}")
+
+    listados = apagados = falhas = 0
+    inicio = time.perf_counter()
+    pendentes = deque()  # (futuro, última chave do lote, quantidade), na ordem da listagem
+
+    def concluir_pendentes(bloquear):
+        nonlocal apagados, falhas
+        while pendentes and (bloquear or pendentes[0][0].done()):
+            futuro, ultima_chave, quantidade = pendentes.popleft()
+            falhas_lote = futuro.result()
+            falhas += falhas_lote
+            apagados += quantidade - falhas_lote
+            if not simular:
+                gravar_checkpoint(ultima_chave, caminho_checkpoint)
+
+    def relatar():
+        decorrido = time.perf_counter() - inicio
+        print(
+            f"{listados} listados, {apagados} apagados, {falhas} falhas "
+            f"({listados / decorrido:.0f} listados/s, {apagados / decorrido:.0f} apagados/s)"
+        )
+
+    with ThreadPoolExecutor(max_workers=paralelo) as executor:
+        lote = []
+        objetos = obter_minio().list_objects(BUCKET_RASTREAMENTO, recursive=True, start_after=inicio_chave)
+        for obj in objetos:
+            lote.append(obj)
+            if len(lote) < LIMPEZA_TAMANHO_LOTE:
+                continue
+            listados += len(lote)
+            expirados = selecionar_expirados(lote, limite_retencao, limite_carencia)
+            ultima_chave = lote[-1].object_name
+            lote = []
+
+            if simular:
+                apagados += len(expirados)
+            else:
+                # Limita as remoções em andamento para não acumular lotes na memória
+                while len(pendentes) >= paralelo * 2:
+                    concluir_pendentes(bloquear=True)
+                futuro = executor.submit(remover_lote, expirados) if expirados else executor.submit(int)
+                pendentes.append((futuro, ultima_chave, len(expirados)))
+                concluir_pendentes(bloquear=False)
+
+            # Limite de apagados por segundo, para não competir com o tráfego normal do MinIO
+            if max_por_segundo:
+                adiantado = (apagados + sum(p[2] for p in pendentes)) / max_por_segundo - (time.perf_counter() - inicio)
+                if adiantado > 0:
+                    time.sleep(adiantado)
+            relatar()
+
+        if lote:
+            listados += len(lote)
+            expirados = selecionar_expirados(lote, limite_retencao, limite_carencia)
+            if simular:
+                apagados += len(expirados)
+            else:
+                futuro = executor.submit(remover_lote, expirados) if expirados else executor.submit(int)
+                pendentes.append((futuro, lote[-1].object_name, len(expirados)))
+        concluir_pendentes(bloquear=True)
+
+    relatar()
+    # Varredura completa: a próxima execução começa do início do bucket
+    if not simular and falhas == 0 and os.path.exists(caminho_checkpoint):
+        os.remove(caminho_checkpoint)
+    return {"listados": listados, "apagados": apagados, "falhas": falhas}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apaga as imagens de rastreamento expiradas do MinIO")
+    parser.add_argument("--retencao-dias", type=int, default=LIMPEZA_RETENCAO_DIAS)
+    parser.add_argument("--carencia-horas", type=int, default=LIMPEZA_CARENCIA_HORAS)
+    parser.add_argument("--paralelo", type=int, default=LIMPEZA_PARALELO)
+    parser.add_argument("--max-por-segundo", type=float, default=0, help="0 = sem limite")
+    parser.add_argument("--simular", action="store_true", help="Só conta o que seria apagado")
+    parser.add_argument("--recomecar", action="store_true", help="Ignora o checkpoint e varre desde o início")
+    args = parser.parse_args()
+
+    if args.recomecar and os.path.exists(LIMPEZA_CHECKPOINT):
+        os.remove(LIMPEZA_CHECKPOINT)
+    garantir_indice_rastreamento()
+    resultado = limpar_rastreamento(
+        args.retencao_dias, args.carencia_horas, args.paralelo, args.max_por_segundo, args.simular
+    )
+    raise SystemExit(1 if resultado["falhas"] else 0)
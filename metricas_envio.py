@@ -0,0 +1,284 @@
+import os
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Endpoint no formato texto do Prometheus; sem METRICAS_PORTA ele não é iniciado
+METRICAS_PORTA = os.getenv("METRICAS_PORTA")
+# Porta base de cada papel; os processos de um papel usam portas seguidas a partir da sua base
+# Sem as variáveis próprias: painel em METRICAS_PORTA, workers da fila a partir de +100 e da CLI a partir de +200
+METRICAS_PORTAS_PAPEL = {
+    "painel": (None, 0),
+    "fila": (os.getenv("METRICAS_PORTA_FILA"), 100),
+    "lote": (os.getenv("METRICAS_PORTA_LOTE"), 200),
+}
+METRICAS_PREFIXO = "painel_emails_"
+METRICAS_JANELA_TAXA = 60  # Segundos usados no cálculo de e-mails por segundo
+
+# Limites (segundos) dos histogramas de duração das etapas
+LIMITES_DURACAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Descrição de cada métrica (linha HELP do Prometheus), declarada uma única vez
+AJUDAS = {
+    "emails_total": "E-mails processados por resultado",
+    "smtp_erros_total": "Falhas de envio por código de resposta SMTP",
+    "emails_por_segundo": f"E-mails enviados por segundo nos últimos {METRICAS_JANELA_TAXA}s",
+    "fila_profundidade": "E-mails na fila de envio por status",
+    "smtp_conexao_segundos": "Conexão TCP e STARTTLS com o servidor SMTP",
+    "smtp_login_segundos": "Autenticação no servidor SMTP",
+    "smtp_envio_segundos": "Envio SMTP de uma mensagem, incluindo reconexões",
+    "montagem_mime_segundos": "Renderização do modelo e montagem da mensagem MIME",
+    "registro_envio_segundos": "Gravação do resultado dos envios no banco",
+    "pixel_upload_segundos": "Upload e assinatura do pixel de rastreamento no MinIO",
+}
+
+_lock = threading.Lock()
+_contadores = {}  # nome -> {rótulos: valor}
+_histogramas = {}  # nome -> {rótulos: [contagem por limite..., +Inf, soma]}
+_medidores = {}  # nome -> função que retorna um número ou [(rótulos, valor)]
+_envios = deque()  # Horários dos envios concluídos dentro da janela da taxa
+_servidor = None
+
+
+def _rotulos(rotulos):
+    return tuple(sorted((chave, str(valor)) for chave, valor in rotulos.items()))
+
+# Função para somar a um contador (ex.: contar("emails_total", resultado="enviado"))
+def contar(nome, valor=1, **rotulos):
+    chave = _rotulos(rotulos)
+    with _lock:
+        serie = _contadores.setdefault(nome, {})
+        serie[chave] = serie.get(chave, 0) + valor
+
+# Função para registrar uma duração (em segundos) no histograma da etapa
+def observar(nome, segundos, **rotulos):
+    chave = _rotulos(rotulos)
+    with _lock:
+        serie = _histogramas.setdefault(nome, {})
+        contagens = serie.get(chave)
+        if contagens is None:
+            contagens = serie[chave] = [0] * (len(LIMITES_DURACAO) + 1) + [0.0]
+        for indice, limite in enumerate(LIMITES_DURACAO):
+            if segundos <= limite:
+                contagens[indice] += 1
+                break
+        else:
+            contagens[len(LIMITES_DURACAO)] += 1
+        contagens[-1] += segundos
+
+# Mede o tempo do bloco, inclusive quando ele termina com erro
+@contextmanager
+def medir(nome, **rotulos):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar(nome, time.perf_counter() - inicio, **rotulos)
+
+# Função para registrar um valor lido na hora da coleta (ex.: profundidade da fila)
+def registrar_medidor(nome, funcao):
+    with _lock:
+        _medidores[nome] = funcao
+
+# Função para contar o resultado de um envio; falhas SMTP são separadas pelo código de resposta
+def registrar_resultado_envio(erro=None):
+    if erro is None:
+        contar("emails_total", resultado="enviado")
+        with _lock:
+            _envios.append(time.monotonic())
+        return
+    contar("emails_total", resultado="falha")
+    if isinstance(erro, smtplib.SMTPResponseException):
+        codigo = erro.smtp_code
+    elif isinstance(erro, smtplib.SMTPRecipientsRefused):
+        codigo = next((resposta[0] for resposta in erro.recipients.values()), "recusado")
+    else:
+        codigo = type(erro).__name__
+    contar("smtp_erros_total", codigo=codigo)
+
+# Função para calcular os e-mails enviados por segundo na janela recente
+def taxa_envio(janela=METRICAS_JANELA_TAXA):
+    agora = time.monotonic()
+    with _lock:
+        while _envios and _envios[0] < agora - janela:
+            _envios.popleft()
+        return len(_envios) / janela
+
+def _ler_medidores():
+    valores = {"emails_por_segundo": [((), taxa_envio())]}
+    with _lock:
+        medidores = dict(_medidores)
+    for nome, funcao in medidores.items():
+        try:
+            resultado = funcao()
+        except Exception as e:
+            print(f"Erro ao coletar a métrica {nome}: {e}")
+            continue
+        if isinstance(resultado, (int, float)):
+            valores[nome] = [((), resultado)]
+        else:
+            valores[nome] = [(_rotulos(rotulos), valor) for rotulos, valor in resultado]
+    return valores
+
+def _formatar_rotulos(rotulos, extra=()):
+    pares = list(rotulos) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{chave}="{valor}"' for chave, valor in pares) + "}"
+
+# Função para gerar o texto de exposição do Prometheus com todas as métricas do processo
+def texto_prometheus():
+    medidores = _ler_medidores()
+    linhas = []
+    with _lock:
+        for nome, serie in sorted(_contadores.items()):
+            linhas.append(f"# HELP {METRICAS_PREFIXO}{nome} {AJUDAS.get(nome, '')}")
+            linhas.append(f"# TYPE {METRICAS_PREFIXO}{nome} counter")
+            for rotulos, valor in serie.items():
+                linhas.append(f"{METRICAS_PREFIXO}{nome}{_formatar_rotulos(rotulos)} {valor}")
+        for nome, serie in sorted(_histogramas.items()):
+            linhas.append(f"# HELP {METRICAS_PREFIXO}{nome} {AJUDAS.get(nome, '')}")
+            linhas.append(f"# TYPE {METRICAS_PREFIXO}{nome} histogram")
+            for rotulos, contagens in serie.items():
+                acumulado = 0
+                for limite, contagem in zip(LIMITES_DURACAO + ("+Inf",), contagens):
+                    acumulado += contagem
+                    linhas.append(
+                        f"{METRICAS_PREFIXO}{nome}_bucket{_formatar_rotulos(rotulos, [('le', limite)])} {acumulado}"
+                    )
+                linhas.append(f"{METRICAS_PREFIXO}{nome}_sum{_formatar_rotulos(rotulos)} {contagens[-1]}")
+                linhas.append(f"{METRICAS_PREFIXO}{nome}_count{_formatar_rotulos(rotulos)} {acumulado}")
+    for nome, serie in sorted(medidores.items()):
+        linhas.append(f"# HELP {METRICAS_PREFIXO}{nome} {AJUDAS.get(nome, '')}")
+        linhas.append(f"# TYPE {METRICAS_PREFIXO}{nome} gauge")
+        for rotulos, valor in serie:
+            linhas.append(f"{METRICAS_PREFIXO}{nome}{_formatar_rotulos(rotulos)} {valor}")
+    return "\n".join(linhas) + "\n"
+
+def _quantil(contagens, total, quantil):
+    # Estimativa pelo limite do primeiro intervalo que alcança o quantil
+    alvo = quantil * total
+    acumulado = 0
+    for limite, contagem in zip(LIMITES_DURACAO, contagens):
+        acumulado += contagem
+        if acumulado >= alvo:
+            return limite
+    return float("inf")
+
+def _descrever(rotulos):
+    return ", ".join(f"{chave}={valor}" for chave, valor in rotulos)
+
+# Função para exportar os valores acumulados do processo (serializáveis em JSON)
+# O painel soma os exportados pelos workers aos seus, em instantaneo(outros)
+def exportar():
+    taxa = taxa_envio()
+    with _lock:
+        return {
+            "contadores": [
+                [nome, [list(par) for par in rotulos], valor]
+                for nome, serie in _contadores.items()
+                for rotulos, valor in serie.items()
+            ],
+            "histogramas": [
+                [nome, [list(par) for par in rotulos], list(contagens)]
+                for nome, serie in _histogramas.items()
+                for rotulos, contagens in serie.items()
+            ],
+            "emails_por_segundo": taxa,
+        }
+
+# Função para obter as métricas em tabelas simples (listas de linhas), para o painel do Streamlit
+# outros: valores exportados por outros processos (ex.: workers), somados aos deste processo
+def instantaneo(outros=()):
+    medidores = _ler_medidores()
+    with _lock:
+        contadores = {nome: dict(serie) for nome, serie in _contadores.items()}
+        histogramas = {
+            nome: {rotulos: list(contagens) for rotulos, contagens in serie.items()}
+            for nome, serie in _histogramas.items()
+        }
+    for dados in outros:
+        for nome, rotulos, valor in dados["contadores"]:
+            serie = contadores.setdefault(nome, {})
+            chave = tuple(tuple(par) for par in rotulos)
+            serie[chave] = serie.get(chave, 0) + valor
+        for nome, rotulos, contagens in dados["histogramas"]:
+            serie = histogramas.setdefault(nome, {})
+            chave = tuple(tuple(par) for par in rotulos)
+            atuais = serie.get(chave)
+            serie[chave] = contagens if atuais is None else [a + b for a, b in zip(atuais, contagens)]
+        medidores["emails_por_segundo"] = [((), medidores["emails_por_segundo"][0][1] + dados["emails_por_segundo"])]
+
+    etapas = []
+    for nome, serie in sorted(histogramas.items()):
+        for rotulos, contagens in serie.items():
+            total = sum(contagens[:-1])
+            etapas.append({
+                "etapa": nome,
+                "rotulos": _descrever(rotulos),
+                "chamadas": total,
+                "total_s": round(contagens[-1], 3),
+                "media_ms": round(contagens[-1] / total * 1000, 1) if total else 0.0,
+                "p95_ms": _quantil(contagens, total, 0.95) * 1000 if total else 0.0,
+            })
+    return {
+        "etapas": etapas,
+        "contadores": [
+            {"metrica": nome, "rotulos": _descrever(rotulos), "valor": valor}
+            for nome, serie in sorted(contadores.items())
+            for rotulos, valor in serie.items()
+        ],
+        "medidores": [
+            {"metrica": nome, "rotulos": _descrever(rotulos), "valor": valor}
+            for nome, serie in sorted(medidores.items())
+            for rotulos, valor in serie
+        ],
+    }
+
+class _TratadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        corpo = texto_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, formato, *args):
+        pass  # Uma coleta a cada poucos segundos não precisa ir para o log
+
+# Função para obter a porta base de um papel ("painel", "fila" ou "lote"); None sem METRICAS_PORTA
+def porta_base(papel):
+    porta_propria, deslocamento = METRICAS_PORTAS_PAPEL[papel]
+    if porta_propria:
+        return int(porta_propria)
+    if not METRICAS_PORTA:
+        return None
+    return int(METRICAS_PORTA) + deslocamento
+
+# Função para iniciar o endpoint /metrics em segundo plano (uma vez por processo)
+# Vários processos do mesmo papel no nó usam portas seguidas: porta base do papel + deslocamento
+def iniciar_servidor_metricas(papel="painel", deslocamento=0, porta=None):
+    global _servidor
+    if porta is None:
+        porta = porta_base(papel)
+        if porta is None:
+            return None
+    with _lock:
+        if _servidor is not None:
+            return _servidor
+        try:
+            _servidor = ThreadingHTTPServer(("0.0.0.0", porta + deslocamento), _TratadorMetricas)
+        except OSError as e:
+            print(f"Erro ao iniciar o endpoint de métricas na porta {porta + deslocamento}: {e}")
+            return None
+    threading.Thread(target=_servidor.serve_forever, daemon=True).start()
+    print(f"Métricas disponíveis em http://0.0.0.0:{porta + deslocamento}/metrics")
+    return _servidor
@@ -0,0 +1,134 @@
+import argparse
+import threading
+
+from banco import conexao, conexao_autocommit
+
+# Migrações do esquema, aplicadas só por este comando (python migracoes.py), antes de subir o painel e os workers
+# O painel e os workers apenas verificam o esquema: nenhum DDL roda numa sessão do Streamlit
+TABELAS = [
+    """
+    CREATE TABLE IF NOT EXISTS campanhas_email (
+        id BIGSERIAL PRIMARY KEY,
+        remetente TEXT NOT NULL,
+        assunto TEXT NOT NULL,
+        modelo TEXT NOT NULL,
+        hash_modelo TEXT NOT NULL,
+        criada_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+        UNIQUE (remetente, assunto, hash_modelo)
+    )
+    """,
+    # Métricas publicadas pelos workers (uma linha por processo), somadas na aba de métricas do painel
+    """
+    CREATE TABLE IF NOT EXISTS metricas_processos (
+        processo TEXT PRIMARY KEY,
+        papel TEXT NOT NULL,
+        dados JSONB NOT NULL,
+        atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    # Colunas novas sem valor padrão volátil: só alteram o catálogo, sem reescrever a tabela
+    """
+    ALTER TABLE rastreamento_emails
+        ADD COLUMN IF NOT EXISTS campanha_id BIGINT REFERENCES campanhas_email (id),
+        ADD COLUMN IF NOT EXISTS valores JSONB,
+        ADD COLUMN IF NOT EXISTS aprovado_por TEXT,
+        ADD COLUMN IF NOT EXISTS lote_aprovacao TEXT,
+        ADD COLUMN IF NOT EXISTS tentativas INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS reivindicado_por TEXT,
+        ADD COLUMN IF NOT EXISTS reivindicado_em TIMESTAMPTZ,
+        ADD COLUMN IF NOT EXISTS erro_envio TEXT
+    """,
+]
+
+# Busca por id_rastreamento do servidor do pixel e da limpeza
+# As consultas comparam id_rastreamento::text, então o índice é sobre a mesma expressão (vale para coluna uuid ou text)
+INDICE_ID_RASTREAMENTO = (
+    "idx_rastreamento_emails_id_rastreamento_texto", "rastreamento_emails ((id_rastreamento::text))"
+)
+
+# Índices criados com CONCURRENTLY: não bloqueiam as gravações na tabela durante a construção
+INDICES = [
+    ("idx_rastreamento_emails_campanha", "rastreamento_emails (campanha_id)"),
+    # Reivindicação da fila
+    ("idx_rastreamento_emails_na_fila", "rastreamento_emails (id) WHERE status = 'Na Fila'"),
+    # Andamento de cada aprovação no painel
+    (
+        "idx_rastreamento_emails_lote_aprovacao",
+        "rastreamento_emails (lote_aprovacao) WHERE lote_aprovacao IS NOT NULL"
+    ),
+    # Contagem da fila nas métricas (Na Fila e Enviando) sem varrer a tabela
+    ("idx_rastreamento_emails_na_fila_status", "rastreamento_emails (status) WHERE status IN ('Na Fila', 'Enviando')"),
+    # Paginação por keyset das telas de rastreamento e aprovação
+    ("idx_rastreamento_emails_data_envio_id", "rastreamento_emails (data_envio, id)"),
+    INDICE_ID_RASTREAMENTO,
+]
+
+# Colunas que o código atual espera em rastreamento_emails
+COLUNAS_ESPERADAS = (
+    "campanha_id", "valores", "aprovado_por", "lote_aprovacao", "tentativas", "reivindicado_por", "reivindicado_em",
+    "erro_envio"
+)
+
+# Função para criar um índice sem bloquear a tabela (idempotente)
+# Um CREATE INDEX CONCURRENTLY interrompido deixa o índice inválido: ele é removido e criado de novo
+def criar_indice(cursor, nome, definicao):
+    cursor.execute("""
+    SELECT i.indisvalid
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE c.relname = %s AND pg_catalog.pg_table_is_visible(c.oid)
+    """, (nome,))
+    resultado = cursor.fetchone()
+    if resultado is not None and resultado[0]:
+        return False
+    if resultado is not None:
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+    cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {definicao}")
+    return True
+
+# Função para aplicar as migrações (idempotente); retorna os índices criados nesta execução
+def aplicar_migracoes():
+    criados = []
+    with conexao_autocommit() as conn:
+        cursor = conn.cursor()
+        for comando in TABELAS:
+            cursor.execute(comando)
+        for nome, definicao in INDICES:
+            if criar_indice(cursor, nome, definicao):
+                criados.append(nome)
+        cursor.close()
+    return criados
+
+_esquema_verificado = False
+_lock_esquema = threading.Lock()
+
+# Função para conferir, uma vez por processo, se as migrações já foram aplicadas (somente leitura)
+def verificar_esquema():
+    global _esquema_verificado
+    if _esquema_verificado:
+        return
+    with _lock_esquema:
+        if _esquema_verificado:
+            return
+        with conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'rastreamento_emails' AND column_name = ANY(%s)
+            """, (list(COLUNAS_ESPERADAS),))
+            existentes = {linha[0] for linha in cursor.fetchall()}
+            cursor.close()
+        faltando = [coluna for coluna in COLUNAS_ESPERADAS if coluna not in existentes]
+        if faltando:
+            raise RuntimeError(
+                f"Esquema do banco desatualizado (faltam as colunas {', '.join(faltando)}): rode python migracoes.py"
+            )
+        _esquema_verificado = True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aplica as migrações do banco de dados")
+    parser.parse_args()
+
+    criados = aplicar_migracoes()
+    print(f"Esquema atualizado; índices criados: {', '.join(criados) if criados else 'nenhum'}")
@@ -0,0 +1,68 @@
+import html
+import re
+from functools import lru_cache
+
+# Campos no formato {{ Campo }}; os marcadores antigos sem chaves continuam valendo
+PADRAO_CAMPO = r"\{\{\s*([\w-]+)\s*\}\}"
+CAMPOS_LEGADOS = ("Nome-RU", "rastreamento_url")
+_REGEX_CAMPOS = re.compile(PADRAO_CAMPO + "|(" + "|".join(re.escape(campo) for campo in CAMPOS_LEGADOS) + ")")
+
+# Campo preenchido no envio, não pela planilha de destinatários
+CAMPO_RASTREAMENTO = "rastreamento_url"
+
+
+# Modelo de e-mail compilado: trechos fixos intercalados com os campos a preencher
+class ModeloEmail:
+    def __init__(self, texto, campos_permitidos=None):
+        self.texto = texto
+        self._partes = []
+        self._campos = []  # (posição em _partes, nome do campo)
+
+        inicio = 0
+        for encontrado in _REGEX_CAMPOS.finditer(texto):
+            self._partes.append(texto[inicio:encontrado.start()])
+            self._campos.append((len(self._partes), encontrado.group(1) or encontrado.group(2)))
+            self._partes.append("")
+            inicio = encontrado.end()
+        self._partes.append(texto[inicio:])
+
+        self.campos = tuple(dict.fromkeys(nome for _, nome in self._campos))
+        if campos_permitidos is not None:
+            self.validar(campos_permitidos)
+
+    # Garante que todos os campos do modelo existem entre as colunas informadas
+    def validar(self, campos_permitidos):
+        desconhecidos = [campo for campo in self.campos if campo not in set(campos_permitidos)]
+        if desconhecidos:
+            raise ValueError(f"Campos desconhecidos no modelo: {', '.join(desconhecidos)}")
+
+    # Preenche o modelo com os valores de um destinatário
+    # parcial=True mantém como {{ campo }} os campos sem valor, para serem preenchidos depois
+    def renderizar(self, valores, parcial=False, escapar=True):
+        partes = list(self._partes)
+        for posicao, nome in self._campos:
+            if nome in valores and valores[nome] is not None:
+                valor = str(valores[nome])
+                partes[posicao] = html.escape(valor) if escapar else valor
+            elif parcial:
+                partes[posicao] = "{{ " + nome + " }}"
+            else:
+                raise ValueError(f"Valor ausente para o campo '{nome}' do modelo")
+        return "".join(partes)
+
+    # Preenche o modelo para uma lista (ou iterador) de destinatários
+    def renderizar_lote(self, linhas, parcial=False, escapar=True):
+        for linha in linhas:
+            yield self.renderizar(linha, parcial=parcial, escapar=escapar)
+
+
+# Função para compilar um modelo uma única vez por campanha (textos iguais reaproveitam a compilação)
+@lru_cache(maxsize=128)
+def _compilar(texto):
+    return ModeloEmail(texto)
+
+def compilar_modelo(texto, campos_permitidos=None):
+    modelo = _compilar(texto)
+    if campos_permitidos is not None:
+        modelo.validar(campos_permitidos)
+    return modelo
@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import os
+import re
+import struct
+import zlib
+from datetime import datetime
+
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+from pytz import timezone
+
+from banco import conexao, conexao_autocommit
+from migracoes import INDICE_ID_RASTREAMENTO, criar_indice
+
+load_dotenv(".env")
+
+# Configuração do servidor de rastreamento de abertura
+PIXEL_HOST = os.getenv("PIXEL_HOST", "0.0.0.0")
+PIXEL_PORTA = int(os.getenv("PIXEL_PORTA", "8081"))
+PIXEL_FLUSH_SEGUNDOS = float(os.getenv("PIXEL_FLUSH_SEGUNDOS", "5"))  # Intervalo entre gravações no banco
+PIXEL_FLUSH_MAX = int(os.getenv("PIXEL_FLUSH_MAX", "1000"))  # Grava antes do intervalo ao acumular tantas aberturas
+
+fuso_horario_brasil = timezone("America/Sao_Paulo")
+
+_REGEX_CAMINHO = re.compile(r"^/([0-9a-fA-F-]{36})\.png$")
+
+
+# PNG 1x1 branco, montado uma vez na importação
+def _gerar_pixel_png():
+    def bloco(tipo, dados):
+        return struct.pack(">I", len(dados)) + tipo + dados + struct.pack(">I", zlib.crc32(tipo + dados))
+    cabecalho = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + bloco(b"IHDR", cabecalho)
+        + bloco(b"IDAT", zlib.compress(b"\x00\xff\xff\xff"))
+        + bloco(b"IEND", b"")
+    )
+
+PIXEL_PNG = _gerar_pixel_png()
+
+_RESPOSTA_PIXEL = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: image/png\r\n"
+    b"Content-Length: " + str(len(PIXEL_PNG)).encode() + b"\r\n"
+    b"Cache-Control: no-store, no-cache, must-revalidate\r\n"
+    b"Connection: close\r\n\r\n" + PIXEL_PNG
+)
+_RESPOSTA_404 = b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+
+# Acumula as aberturas em memória e grava em lote em rastreamento_emails
+class BufferAberturas:
+    def __init__(self):
+        self._aberturas = {}
+        self._cheio = asyncio.Event()
+
+    def registrar(self, id_rastreamento):
+        # Só a primeira abertura de cada e-mail interessa
+        self._aberturas.setdefault(id_rastreamento, datetime.now(fuso_horario_brasil))
+        if len(self._aberturas) >= PIXEL_FLUSH_MAX:
+            self._cheio.set()
+
+    async def executar(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._cheio.wait(), timeout=PIXEL_FLUSH_SEGUNDOS)
+            except asyncio.TimeoutError:
+                pass
+            await self.gravar()
+
+    async def gravar(self):
+        self._cheio.clear()
+        if not self._aberturas:
+            return
+        aberturas, self._aberturas = self._aberturas, {}
+        try:
+            atualizados = await asyncio.to_thread(gravar_aberturas, list(aberturas.items()))
+            print(f"{len(aberturas)} aberturas recebidas, {atualizados} e-mails marcados como abertos")
+        except Exception as e:
+            print(f"Erro ao gravar aberturas: {e}")
+            # Devolve ao buffer para tentar de novo na próxima gravação
+            for id_rastreamento, data in aberturas.items():
+                self._aberturas.setdefault(id_rastreamento, data)
+
+# Função para gravar um lote de aberturas [(id_rastreamento, data_abertura)] com um único UPDATE
+def gravar_aberturas(aberturas):
+    query = """
+    UPDATE rastreamento_emails r
+    SET status = 'Aberto', data_abertura = v.data_abertura
+    FROM (VALUES %s) AS v (id_rastreamento, data_abertura)
+    WHERE r.id_rastreamento::text = v.id_rastreamento
+      AND r.data_abertura IS NULL
+      AND r.status IN ('Não Aberto', 'Enviando')
+    """
+    with conexao() as conn:
+        cursor = conn.cursor()
+        execute_values(cursor, query, aberturas, template="(%s, %s::timestamptz)")
+        atualizados = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return atualizados
+
+# Função para criar o índice usado na gravação das aberturas e na limpeza (idempotente)
+# CONCURRENTLY, fora de transação: subir o servidor não bloqueia as gravações em rastreamento_emails
+def garantir_indice_rastreamento():
+    with conexao_autocommit() as conn:
+        cursor = conn.cursor()
+        criar_indice(cursor, *INDICE_ID_RASTREAMENTO)
+        cursor.close()
+
+async def _atender(reader, writer, buffer):
+    try:
+        linha = await asyncio.wait_for(reader.readline(), timeout=10)
+        # Descarta os cabeçalhos: o pixel não depende deles
+        while True:
+            cabecalho = await asyncio.wait_for(reader.readline(), timeout=10)
+            if cabecalho in (b"\r\n", b"\n", b""):
+                break
+
+        partes = linha.decode("latin-1").split()
+        caminho = partes[1].split("?", 1)[0] if len(partes) >= 2 and partes[0] in ("GET", "HEAD") else ""
+        encontrado = _REGEX_CAMINHO.match(caminho)
+        if encontrado:
+            buffer.registrar(encontrado.group(1).lower())
+            writer.write(_RESPOSTA_PIXEL)
+        else:
+            writer.write(_RESPOSTA_404)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def servir(host=PIXEL_HOST, porta=PIXEL_PORTA):
+    buffer = BufferAberturas()
+    servidor = await asyncio.start_server(lambda r, w: _atender(r, w, buffer), host, porta)
+    print(f"Servidor de rastreamento ouvindo em {host}:{porta}")
+    gravacao = asyncio.create_task(buffer.executar())
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        gravacao.cancel()
+        await buffer.gravar()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor do pixel de rastreamento de abertura")
+    parser.add_argument("--host", default=PIXEL_HOST)
+    parser.add_argument("--porta", type=int, default=PIXEL_PORTA)
+    args = parser.parse_args()
+
+    garantir_indice_rastreamento()
+    try:
+        asyncio.run(servir(args.host, args.porta))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,181 @@
+import os
+import smtplib
+import socket
+import threading
+import time
+
+from metricas_envio import medir, observar
+
+# Configuração do servidor SMTP do Office 365
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.office365.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+
+# Reaproveitamento das sessões autenticadas
+SMTP_MAX_MENSAGENS = int(os.getenv("SMTP_MAX_MENSAGENS", "100"))  # Recicla a sessão após N mensagens
+SMTP_NOOP_SEGUNDOS = float(os.getenv("SMTP_NOOP_SEGUNDOS", "30"))  # Envia NOOP em sessões ociosas há mais tempo que isso
+SMTP_OCIOSA_MAX = float(os.getenv("SMTP_OCIOSA_MAX", "240"))  # Fecha sessões sem envios há mais tempo que isso
+
+# Falhas que indicam conexão perdida: reconecta e tenta de novo uma vez
+ERROS_RECONEXAO = (smtplib.SMTPServerDisconnected, socket.timeout, ConnectionError)
+
+
+# Sessão SMTP autenticada de uma conta remetente
+class SessaoSMTP:
+    def __init__(self, usuario, senha, servidor=SMTP_SERVER, porta=SMTP_PORT):
+        self.usuario = usuario
+        self.senha = senha
+        self.servidor = servidor
+        self.porta = porta
+        self.lock = threading.Lock()
+        self._smtp = None
+        self.mensagens_na_sessao = 0
+        self.ultimo_uso = 0.0  # Último comando no servidor (envio ou NOOP)
+        self.ultimo_envio = time.monotonic()  # Último envio de verdade: o NOOP não conta
+        self.conexoes = 0
+
+    def _conectar(self):
+        self._fechar()
+        inicio = time.perf_counter()
+        smtp = smtplib.SMTP(self.servidor, self.porta, timeout=SMTP_TIMEOUT)
+        try:
+            smtp.starttls()  # Inicia a conexão segura
+            observar("smtp_conexao_segundos", time.perf_counter() - inicio)
+            with medir("smtp_login_segundos"):
+                smtp.login(self.usuario, self.senha)  # Autenticação
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self.mensagens_na_sessao = 0
+        self.ultimo_uso = time.monotonic()
+        self.conexoes += 1
+
+    def _fechar(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+    # Garante uma conexão autenticada, validando com NOOP se estiver ociosa
+    def _garantir_conexao(self):
+        if self._smtp is None or self.mensagens_na_sessao >= SMTP_MAX_MENSAGENS:
+            self._conectar()
+            return
+        ociosa = time.monotonic() - self.ultimo_uso
+        if ociosa > SMTP_OCIOSA_MAX:
+            self._conectar()
+        elif ociosa > SMTP_NOOP_SEGUNDOS and not self._noop():
+            self._conectar()
+
+    def _noop(self):
+        try:
+            codigo, _ = self._smtp.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        if codigo != 250:
+            return False
+        self.ultimo_uso = time.monotonic()
+        return True
+
+    def conectar(self):
+        with self.lock:
+            self._garantir_conexao()
+            self.ultimo_envio = time.monotonic()
+
+    def enviar(self, remetente, destinatarios, mensagem):
+        with self.lock, medir("smtp_envio_segundos"):
+            self._garantir_conexao()
+            try:
+                recusados = self._smtp.sendmail(remetente, destinatarios, mensagem)
+            except smtplib.SMTPResponseException as e:
+                # 421: o servidor encerrou o canal (limite de sessão, manutenção)
+                if e.smtp_code != 421:
+                    raise
+                self._conectar()
+                recusados = self._smtp.sendmail(remetente, destinatarios, mensagem)
+            except ERROS_RECONEXAO:
+                self._conectar()
+                recusados = self._smtp.sendmail(remetente, destinatarios, mensagem)
+            self.mensagens_na_sessao += 1
+            self.ultimo_uso = time.monotonic()
+            self.ultimo_envio = self.ultimo_uso
+            return recusados
+
+    def enviar_mensagem(self, msg):
+        return self.enviar(msg["From"], msg["To"], msg.as_string())
+
+    # Mantém viva (NOOP) ou fecha a sessão, conforme o tempo sem envios
+    # Retorna True quando a sessão foi encerrada por ociosidade
+    def manter_viva(self):
+        if not self.lock.acquire(blocking=False):
+            return False  # Sessão em uso: não precisa de keepalive
+        try:
+            agora = time.monotonic()
+            if agora - self.ultimo_envio > SMTP_OCIOSA_MAX:
+                self._fechar()
+                return True
+            if self._smtp is not None and agora - self.ultimo_uso > SMTP_NOOP_SEGUNDOS and not self._noop():
+                self._fechar()
+            return False
+        finally:
+            self.lock.release()
+
+    def fechar(self):
+        with self.lock:
+            self._fechar()
+
+
+# Gerenciador das sessões SMTP do processo, uma por conta remetente
+class GerenciadorSessoesSMTP:
+    def __init__(self):
+        self._sessoes = {}
+        self._lock = threading.Lock()
+        self._keepalive = None
+
+    def obter(self, usuario, senha, servidor=SMTP_SERVER, porta=SMTP_PORT):
+        chave = (servidor, porta, usuario.lower())
+        with self._lock:
+            sessao = self._sessoes.get(chave)
+            if sessao is None or sessao.senha != senha:
+                if sessao is not None:
+                    sessao.fechar()
+                sessao = SessaoSMTP(usuario, senha, servidor, porta)
+                self._sessoes[chave] = sessao
+            self._iniciar_keepalive()
+        return sessao
+
+    def _iniciar_keepalive(self):
+        if self._keepalive is None or not self._keepalive.is_alive():
+            self._keepalive = threading.Thread(target=self._loop_keepalive, daemon=True)
+            self._keepalive.start()
+
+    def _loop_keepalive(self):
+        while True:
+            time.sleep(SMTP_NOOP_SEGUNDOS)
+            with self._lock:
+                sessoes = list(self._sessoes.items())
+            for chave, sessao in sessoes:
+                if sessao.manter_viva():
+                    # Sessão encerrada sai do gerenciador; a próxima obter() cria outra
+                    with self._lock:
+                        if self._sessoes.get(chave) is sessao:
+                            del self._sessoes[chave]
+
+    def fechar_todas(self):
+        with self._lock:
+            sessoes = list(self._sessoes.values())
+            self._sessoes.clear()
+        for sessao in sessoes:
+            sessao.fechar()
+
+
+# Gerenciador compartilhado por todos os caminhos de envio do processo
+gerenciador_smtp = GerenciadorSessoesSMTP()
+
+
+# Função para obter a sessão SMTP autenticada de uma conta remetente
+def obter_sessao_smtp(usuario, senha, servidor=SMTP_SERVER, porta=SMTP_PORT):
+    return gerenciador_smtp.obter(usuario, senha, servidor, porta)
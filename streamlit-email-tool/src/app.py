@@ -1,5 +1,6 @@
 import streamlit as st
 from email_sender import EmailSender
+from destinatarios import iter_recipients
 import os
 
 # Configurações do SMTP
@@ -17,20 +18,29 @@ st.title("Envio de E-mails em Massa")
 # Campos de entrada
 subject = st.text_input("Assunto do E-mail")
 body = st.text_area("Corpo do E-mail")
-uploaded_file = st.file_uploader("Carregar arquivo Excel com lista de e-mails", type=["xlsx"])
+uploaded_file = st.file_uploader("Carregar arquivo Excel ou CSV com lista de e-mails", type=["xlsx", "csv"])
 
 # Botão para enviar e-mails
 if st.button("Enviar E-mails"):
     if uploaded_file and subject and body:
-        # Lê a lista de e-mails do arquivo Excel
-        email_list = email_sender.read_email_list(uploaded_file)
-        st.write(f"Total de e-mails carregados: {len(email_list)}")
+        # Lê a lista de e-mails em blocos, conforme o envio avança
+        recipients = iter_recipients(uploaded_file)
+        progress = st.empty()
+        processed = {"total": 0}
+
+        def on_result(recipient, error):
+            processed["total"] += 1
+            if processed["total"] % 50 == 0:
+                progress.write(f"E-mails processados: {processed['total']}")
 
         # Envia os e-mails
         try:
-            email_sender.send_bulk_emails(email_list, subject, body)
-            st.success("E-mails enviados com sucesso!")
+            failures = email_sender.send_bulk_emails(recipients, subject, body, on_result)
+            progress.write(f"E-mails processados: {processed['total']}")
+            st.success(f"E-mails enviados com sucesso! ({email_sender.messages_per_second:.2f} e-mails/s)")
+            if failures:
+                st.warning(f"{len(failures)} e-mails não puderam ser enviados: {', '.join(recipient for recipient, _ in failures)}")
         except Exception as e:
             st.error(f"Erro ao enviar e-mails: {e}")
     else:
-        st.warning("Por favor, preencha todos os campos e carregue o arquivo Excel.")
\ No newline at end of file
+        st.warning("Por favor, preencha todos os campos e carregue o arquivo Excel ou CSV.")
\ No newline at end of file
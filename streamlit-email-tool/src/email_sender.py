@@ -1,10 +1,12 @@
-from openpyxl import load_workbook
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import pandas as pd
-from datetime import datetime, timedelta
-import time
+# Módulos compartilhados com o painel principal ficam na raiz do repositório:
+# rode a ferramenta a partir da raiz com python -m streamlit run streamlit-email-tool/src/app.py
+from limitador_taxa import RateLimiter
+from smtp_sessoes import obter_sessao_smtp
+from despacho_smtp import DespachanteSMTP
+from destinatarios import iter_recipients
+from modelo_email import compilar_modelo
 
 class EmailSender:
     def __init__(self, smtp_server, smtp_port, smtp_user, smtp_password):
@@ -13,36 +15,49 @@ class EmailSender:
         self.smtp_user = smtp_user
         self.smtp_password = smtp_password
         self.sent_emails = 0
-        self.start_time = datetime.now()
+        self.messages_per_second = 0.0
+        self.rate_limiter = RateLimiter()
 
     def read_email_list(self, file_path):
-        df = pd.read_excel(file_path)
-        return df['Email'].tolist()
+        return [row['Email'] for chunk in iter_recipients(file_path) for row in chunk]
+
+    def build_message(self, recipient, subject, body):
+        # Aceita o e-mail puro ou a linha da planilha com as colunas extras (ex.: Nome-RU)
+        row = recipient if isinstance(recipient, dict) else {'Email': recipient}
+        # O corpo é compilado uma vez por texto; campos sem valor na linha ficam no texto
+        body = compilar_modelo(body).renderizar(row, parcial=True, escapar=False)
 
-    def send_email(self, recipient, subject, body):
         msg = MIMEMultipart()
         msg['From'] = self.smtp_user
-        msg['To'] = recipient
+        msg['To'] = row['Email']
         msg['Subject'] = subject
 
         msg.attach(MIMEText(body, 'plain'))
+        return msg
+
+    def send_email(self, recipient, subject, body):
+        msg = self.build_message(recipient, subject, body)
+
+        # Reaproveita a sessão autenticada da conta em vez de conectar a cada mensagem
+        sessao = obter_sessao_smtp(self.smtp_user, self.smtp_password, self.smtp_server, self.smtp_port)
+        sessao.enviar_mensagem(msg)
 
-        with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-            server.starttls()
-            server.login(self.smtp_user, self.smtp_password)
-            server.send_message(msg)
-
-    def rate_limit(self):
-        if self.sent_emails >= 500:
-            if datetime.now() < self.start_time + timedelta(days=1):
-                time_to_wait = (self.start_time + timedelta(days=1)) - datetime.now()
-                time.sleep(time_to_wait.total_seconds())
-            self.sent_emails = 0
-            self.start_time = datetime.now()
-
-    def send_bulk_emails(self, email_list, subject, body):
-        for recipient in email_list:
-            self.rate_limit()
-            self.send_email(recipient, subject, body)
-            self.sent_emails += 1
-            time.sleep(6)  # Sleep for 6 seconds to average 10 emails per minute
+    def send_bulk_emails(self, email_list, subject, body, on_result=None):
+        # Envia por várias conexões em paralelo; os limites por minuto e por dia da conta
+        # vêm do RateLimiter compartilhado entre sessões e processos
+        dispatcher = DespachanteSMTP(
+            self.smtp_user, self.smtp_password,
+            limitador=self.rate_limiter,
+            servidor=self.smtp_server, porta=self.smtp_port
+        )
+        # email_list pode ser uma lista ou um iterador de blocos (iter_recipients): é consumido aos poucos
+        recipients = (
+            recipient
+            for item in email_list
+            for recipient in (item if isinstance(item, list) else [item])
+        )
+        messages = (self.build_message(recipient, subject, body) for recipient in recipients)
+        failures = dispatcher.despachar(messages, on_result)
+        self.sent_emails += dispatcher.enviados
+        self.messages_per_second = dispatcher.mensagens_por_segundo
+        return failures
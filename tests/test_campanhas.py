@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+
+from campanhas import _modelo_da_linha
+from modelo_email import CAMPO_RASTREAMENTO, compilar_modelo
+
+PIXEL = '<img src="{}" alt="" style="display:none;width:1px;height:1px;">'
+
+
+def corpo_enviado(texto, link="https://minio.exemplo/rastreiaemail/abc.png?assinatura=1"):
+    return texto + PIXEL.format(link)
+
+
+def test_modelo_reconstruido_reproduz_o_corpo_gravado():
+    corpo = corpo_enviado("<p>Olá Maria Souza, seu boleto está disponível.</p>")
+
+    modelo = _modelo_da_linha(corpo, "Maria Souza")
+
+    assert modelo is not None
+    assert "{{ Nome-RU }}" in modelo
+    assert "{{ " + CAMPO_RASTREAMENTO + " }}" in modelo
+    novo_link = "https://pixel.exemplo/123.png"
+    renderizado = compilar_modelo(modelo).renderizar({"Nome-RU": "Maria Souza", CAMPO_RASTREAMENTO: novo_link})
+    assert renderizado == corpo_enviado("<p>Olá Maria Souza, seu boleto está disponível.</p>", novo_link)
+
+
+def test_nome_repetido_em_outro_ponto_continua_reproduzindo_o_corpo():
+    corpo = corpo_enviado('<p title="Ana">Prezada Ana, fale com Anastácia.</p>')
+
+    modelo = _modelo_da_linha(corpo, "Ana")
+
+    assert modelo is not None
+    renderizado = compilar_modelo(modelo).renderizar({"Nome-RU": "Ana", CAMPO_RASTREAMENTO: ""})
+    assert renderizado == corpo_enviado('<p title="Ana">Prezada Ana, fale com Anastácia.</p>', "")
+
+
+def test_nome_com_caracteres_escapados_nao_e_migrado():
+    # O nome foi gravado sem escape; no envio atual ele seria escapado e o e-mail mudaria
+    corpo = corpo_enviado("<p>Olá João D'Ávila</p>")
+
+    assert _modelo_da_linha(corpo, "João D'Ávila") is None
+
+
+def test_corpo_com_marcador_literal_nao_e_migrado():
+    corpo = corpo_enviado("<p>Olá Pedro, use {{ codigo }} no portal.</p>")
+
+    assert _modelo_da_linha(corpo, "Pedro") is None
+
+
+def test_linha_sem_nome_mantem_o_texto():
+    corpo = corpo_enviado("<p>Comunicado geral</p>")
+
+    modelo = _modelo_da_linha(corpo, None)
+
+    assert modelo == corpo_enviado("<p>Comunicado geral</p>", "{{ " + CAMPO_RASTREAMENTO + " }}")
@@ -0,0 +1,37 @@
+import json
+
+import metricas_envio
+from metricas_envio import LIMITES_DURACAO, contar, exportar, instantaneo, observar, porta_base
+
+
+def valor(dados, metrica, rotulos):
+    return next(linha["valor"] for linha in dados["contadores"] if (linha["metrica"], linha["rotulos"]) == (metrica, rotulos))
+
+
+def test_instantaneo_soma_as_metricas_exportadas_por_outros_processos():
+    contar("emails_total", 2, resultado="teste_soma")
+    observar("etapa_teste_soma_segundos", 0.004)
+    # O worker publica os valores como JSON no banco
+    worker = json.loads(json.dumps(exportar()))
+
+    dados = instantaneo([worker])
+
+    assert valor(dados, "emails_total", "resultado=teste_soma") == 4
+    etapa = next(linha for linha in dados["etapas"] if linha["etapa"] == "etapa_teste_soma_segundos")
+    assert etapa["chamadas"] == 2
+    assert etapa["p95_ms"] == LIMITES_DURACAO[0] * 1000
+
+
+def test_cada_papel_tem_sua_porta_base(monkeypatch):
+    monkeypatch.setattr(metricas_envio, "METRICAS_PORTA", "9100")
+    monkeypatch.setitem(metricas_envio.METRICAS_PORTAS_PAPEL, "lote", ("9500", 200))
+
+    assert porta_base("painel") == 9100
+    assert porta_base("fila") == 9200
+    assert porta_base("lote") == 9500
+
+
+def test_sem_porta_configurada_o_endpoint_nao_sobe(monkeypatch):
+    monkeypatch.setattr(metricas_envio, "METRICAS_PORTA", None)
+
+    assert porta_base("fila") is None
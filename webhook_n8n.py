@@ -0,0 +1,115 @@
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+load_dotenv(".env")
+
+# Configuração do envio para o webhook do n8n
+N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL")
+N8N_TAMANHO_LOTE = int(os.getenv("N8N_TAMANHO_LOTE", "200"))  # Destinatários por requisição
+N8N_CONCORRENCIA = int(os.getenv("N8N_CONCORRENCIA", "4"))  # Requisições simultâneas
+N8N_TENTATIVAS = int(os.getenv("N8N_TENTATIVAS", "4"))
+N8N_TIMEOUT = float(os.getenv("N8N_TIMEOUT", "60"))  # Segundos por requisição
+N8N_GZIP = os.getenv("N8N_GZIP", "false").lower() in ("1", "true", "sim")  # O n8n precisa aceitar Content-Encoding
+N8N_VERIFICAR_SSL = os.getenv("N8N_VERIFICAR_SSL", "false").lower() in ("1", "true", "sim")
+
+# Respostas que valem uma nova tentativa; as demais (ex.: 400) não mudam ao repetir
+_STATUS_REPETIR = {408, 425, 429, 500, 502, 503, 504}
+
+_sessao = None
+_lock_sessao = threading.Lock()
+
+
+# Função para obter a sessão HTTP do processo, com conexões mantidas abertas entre os lotes
+def obter_sessao_webhook():
+    global _sessao
+    if _sessao is None:
+        with _lock_sessao:
+            if _sessao is None:
+                sessao = requests.Session()
+                adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=max(N8N_CONCORRENCIA, 1))
+                sessao.mount("https://", adaptador)
+                sessao.mount("http://", adaptador)
+                sessao.verify = N8N_VERIFICAR_SSL
+                _sessao = sessao
+    return _sessao
+
+# Função para dividir a lista de destinatários em lotes de tamanho fixo
+def dividir_em_lotes(email_list, tamanho=N8N_TAMANHO_LOTE):
+    return [email_list[inicio:inicio + tamanho] for inicio in range(0, len(email_list), tamanho)]
+
+def _espera(tentativa, resposta=None):
+    # Respeita o Retry-After do servidor quando vier em segundos
+    if resposta is not None and resposta.headers.get("Retry-After", "").isdigit():
+        return float(resposta.headers["Retry-After"])
+    return min(30.0, 0.5 * 2 ** tentativa) + random.uniform(0, 0.5)
+
+# Função para enviar um lote ao webhook, com novas tentativas
+# A chave de idempotência é a mesma em todas as tentativas do lote, para o n8n descartar repetições
+def enviar_lote_webhook(payload, chave_idempotencia, url=None, tentativas=N8N_TENTATIVAS, comprimir=N8N_GZIP):
+    url = url or N8N_WEBHOOK_URL
+    cabecalhos = {"Content-Type": "application/json", "Idempotency-Key": chave_idempotencia}
+    corpo = json.dumps(payload).encode("utf-8")
+    if comprimir:
+        corpo = gzip.compress(corpo)
+        cabecalhos["Content-Encoding"] = "gzip"
+
+    inicio = time.perf_counter()
+    resultado = {"status": "falha", "codigo_http": None, "tentativas": 0, "erro": None}
+    for tentativa in range(max(1, tentativas)):
+        resultado["tentativas"] = tentativa + 1
+        resposta = None
+        try:
+            resposta = obter_sessao_webhook().post(url, data=corpo, headers=cabecalhos, timeout=N8N_TIMEOUT)
+            resultado["codigo_http"] = resposta.status_code
+            if resposta.ok:
+                resultado.update(status="enviado", erro=None)
+                break
+            resultado["erro"] = resposta.text[:500]
+            if resposta.status_code not in _STATUS_REPETIR:
+                break
+        except (requests.ConnectionError, requests.Timeout) as e:
+            resultado["erro"] = str(e)
+        if tentativa + 1 < tentativas:
+            time.sleep(_espera(tentativa, resposta))
+    resultado["duracao"] = time.perf_counter() - inicio
+    return resultado
+
+# Função para enviar a lista de destinatários ao webhook em lotes paralelos
+# payload_base: campos comuns (subject, body, email_user, type); cada lote leva sua parte de email_list
+# id_envio identifica o envio inteiro: repetir com o mesmo id (ex.: só os lotes com falha) reaproveita as chaves
+# ao_concluir(resultado) é chamado na thread de quem chamou, à medida que os lotes terminam
+def despachar_webhook(payload_base, email_list, id_envio=None, lotes=None, tamanho_lote=N8N_TAMANHO_LOTE,
+                      concorrencia=N8N_CONCORRENCIA, ao_concluir=None):
+    id_envio = id_envio or str(uuid.uuid4())
+    partes = dividir_em_lotes(email_list, tamanho_lote)
+    indices = range(len(partes)) if lotes is None else [indice for indice in lotes if indice < len(partes)]
+
+    resultados = []
+    with ThreadPoolExecutor(max_workers=max(1, concorrencia)) as executor:
+        futuros = {}
+        for indice in indices:
+            payload = {
+                **payload_base,
+                "email_list": partes[indice],
+                "batch_id": id_envio,
+                "chunk_index": indice,
+                "chunk_total": len(partes),
+            }
+            futuros[executor.submit(enviar_lote_webhook, payload, f"{id_envio}-{indice}")] = indice
+        for futuro in as_completed(futuros):
+            indice = futuros[futuro]
+            resultado = {"lote": indice, "destinatarios": len(partes[indice]), **futuro.result()}
+            resultados.append(resultado)
+            if ao_concluir:
+                ao_concluir(resultado)
+    return id_envio, sorted(resultados, key=lambda resultado: resultado["lote"])